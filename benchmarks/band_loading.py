@@ -0,0 +1,55 @@
+"""Compare serial and executor-backed CKeychain band loading.
+
+    python -m benchmarks.band_loading --items 20000
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from onepassword.keychain import CKeychain
+
+from .synthetic import make_cloudkeychain
+
+
+def time_load(path, password, executor=None, repeat=3):
+    keychain = CKeychain(path, executor=executor)
+    keychain._load_keys(password)
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        keychain._load_items()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(keychain.items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp(prefix='onepassword-bench-')
+    try:
+        make_cloudkeychain(path, args.items)
+        serial, count = time_load(path, 'password', repeat=args.repeat)
+        print('%d items, serial: %.3fs' % (count, serial))
+        workers = 1
+        while workers <= multiprocessing.cpu_count():
+            for name, executor_class in (('threads', ThreadPoolExecutor), ('processes', ProcessPoolExecutor)):
+                with executor_class(max_workers=workers) as executor:
+                    elapsed, _ = time_load(path, 'password', executor=executor, repeat=args.repeat)
+                print('%9s x%-2d: %.3fs (%.2fx)' % (name, workers, elapsed, serial / elapsed))
+            workers *= 2
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Compare reusable decryptors with the one-shot decryption they replaced.
+
+    python -m benchmarks.decryptor --items 20000
+
+CDecryptor saves the per-record HMAC keying and AES key setup, which came to
+about 1.1-1.3x on opdata01 items and item keys in our runs. Salted
+agilekeychain items get nothing measurable (0.8-1.1x, within the noise):
+every item has its own salt, so its key and IV are derived per item either
+way, and ADecryptor only saves the MD5 of the key for unsalted items.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import time
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.hashes import SHA256
+from cryptography.hazmat.primitives.hmac import HMAC
+
+from onepassword import crypt_util, padding, pbkdf1
+
+from .synthetic import _aes_encrypt, item_key_encrypt
+
+_backend = default_backend()
+
+
+# What every item decryption used to do: fresh HMAC, an extra finalize() of
+# a copy of it, a fresh Cipher, and pbkdf1.PBKDF1 for agilekeychain salts.
+def one_shot_opdata1_decrypt_item(data, key, hmac_key):
+    plaintext_length, iv, cryptext, expected_hmac, hmac_d_data = crypt_util.opdata1_unpack(data)
+    verifier = HMAC(hmac_key, SHA256(), backend=_backend)
+    verifier.update(hmac_d_data)
+    verifier.copy().finalize()
+    verifier.verify(expected_hmac)
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=_backend).decryptor()
+    return padding.ab_unpad(decryptor.update(cryptext) + decryptor.finalize(), plaintext_length)
+
+
+def one_shot_opdata1_decrypt_key(data, key, hmac_key):
+    verifier = HMAC(hmac_key, SHA256(), backend=_backend)
+    verifier.update(data[:80])
+    verifier.verify(data[80:])
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(data[:16]), backend=_backend).decryptor()
+    decrypted = decryptor.update(data[16:80]) + decryptor.finalize()
+    return decrypted[:32], decrypted[32:]
+
+
+def one_shot_a_decrypt_item(data, key):
+    pb_gen = pbkdf1.PBKDF1(key, data[8:16])
+    nkey, iv = pb_gen.read(16), pb_gen.read(16)
+    decryptor = Cipher(algorithms.AES(nkey), modes.CBC(iv), backend=_backend).decryptor()
+    return padding.pkcs5_unpad(decryptor.update(data[16:]) + decryptor.finalize())
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def compare(name, n_items, before, after, repeat):
+    before, after = best_of(before, repeat), best_of(after, repeat)
+    print('%-20s %6.2fus -> %6.2fus per item (%.2fx)' % (
+        name, before / n_items * 1e6, after / n_items * 1e6, before / after))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--data-size', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    key, hmac_key, level_key = os.urandom(32), os.urandom(32), os.urandom(16)
+    c_decryptor = crypt_util.CDecryptor(key, hmac_key)
+    a_decryptor = crypt_util.ADecryptor(level_key)
+    records, item_keys, a_records = [], [], []
+    for _ in range(args.items):
+        records.append(crypt_util.opdata1_encrypt_item(os.urandom(args.data_size), key, hmac_key))
+        item_keys.append(item_key_encrypt(os.urandom(32), os.urandom(32), key, hmac_key))
+        salt = os.urandom(crypt_util.SALT_SIZE)
+        pb_gen = pbkdf1.PBKDF1(level_key, salt)
+        nkey, iv = pb_gen.read(16), pb_gen.read(16)
+        a_records.append(crypt_util.SALT_MARKER + salt + _aes_encrypt(
+            nkey, iv, padding.pkcs5_pad(os.urandom(args.data_size))))
+
+    compare('opdata01 items', args.items,
+            lambda: [one_shot_opdata1_decrypt_item(r, key, hmac_key) for r in records],
+            lambda: [c_decryptor.decrypt_item(r) for r in records],
+            args.repeat)
+    compare('opdata01 item keys', args.items,
+            lambda: [one_shot_opdata1_decrypt_key(r, key, hmac_key) for r in item_keys],
+            lambda: [c_decryptor.decrypt_key(r) for r in item_keys],
+            args.repeat)
+    compare('agilekeychain items', args.items,
+            lambda: [one_shot_a_decrypt_item(r, level_key) for r in a_records],
+            lambda: [a_decryptor.decrypt_item(r) for r in a_records],
+            args.repeat)
+
+
+if __name__ == '__main__':
+    main()
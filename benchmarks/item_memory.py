@@ -0,0 +1,141 @@
+"""Measure memory per item for AItem/CItem against dict-based versions
+of the same classes (what they were before they got __slots__).
+
+    python -m benchmarks.item_memory --items 20000
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import datetime
+import gc
+import os
+import shutil
+import tempfile
+import tracemalloc
+import uuid as uuid_mod
+
+import simplejson
+
+from onepassword.item import C_CATEGORIES, AItem, CItem
+from onepassword.keychain import CKeychain
+
+from .synthetic import make_cloudkeychain
+
+
+class DictAItem(object):
+    def __init__(self, keychain):
+        self.keychain = keychain
+        self.path = None
+        self._data = None
+        self._key_identifier = None
+        self.file_state = None
+
+    def load_from(self, path):
+        with open(path, "r") as f:
+            data = simplejson.load(f)
+            st = os.fstat(f.fileno())
+        self.path = path
+        self.file_state = st.st_mtime, st.st_size
+        self.uuid = data['uuid']
+        self._data = data
+        self.title = data['title']
+        self.category = data.get('typeName')
+        self.domain = data.get('location', '')
+        self.updated = data.get('updatedAt')
+        self._key_identifier = data['keyID']
+
+
+class DictCItem(object):
+    def __init__(self, keychain, d):
+        self.keychain = keychain
+        self.uuid = d['uuid']
+        self.category_code = d['category']
+        self.category = C_CATEGORIES[self.category_code]
+        self.updated = d['updated']
+        self.updated_at = datetime.datetime.fromtimestamp(self.updated)
+        self.encrypted_overview = d.get('o')
+        self._overview = None
+        if 'k' in d:
+            self._encrypted_data = d['k'], d['d']
+        else:
+            self._encrypted_data = None
+
+
+def write_agile_items(directory, n_items, data_size):
+    paths = []
+    for i in range(n_items):
+        uuid = uuid_mod.uuid4().hex.upper()
+        item = {
+            'uuid': uuid,
+            'updatedAt': 1398186806 + i,
+            'createdAt': 1398186618 + i,
+            'locationKey': 'site%d.example.com' % i,
+            'location': 'https://site%d.example.com/login' % i,
+            'keyID': '98EB2E946008403280A3A8D9261018A4',
+            'contentsHash': 'bc91e11',
+            'title': 'Item %d' % i,
+            'typeName': 'webforms.WebForm',
+            'encrypted': base64.b64encode(b'Salted__' + os.urandom(8 + data_size)).decode('ascii'),
+        }
+        path = os.path.join(directory, '%s.1password' % uuid)
+        with open(path, 'w') as f:
+            simplejson.dump(item, f)
+        paths.append(path)
+    return paths
+
+
+def measure(build):
+    """Bytes still allocated per item after build() returns its items"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        items = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return float(size) / len(items)
+
+
+def report(name, before, after):
+    print('%-6s %7.0f -> %7.0f bytes per item (%.0f%% less)' % (name, before, after, 100 * (1 - after / before)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--data-size', type=int, default=256)
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp(prefix='onepassword-bench-')
+    try:
+        make_cloudkeychain(os.path.join(path, 'vault.cloudkeychain'), args.items, data_size=args.data_size)
+        keychain = CKeychain(os.path.join(path, 'vault.cloudkeychain'))
+        keychain._load_keys('password')
+        band_paths = keychain._band_paths()
+
+        def c_items(cls):
+            return lambda: [cls(keychain, blob) for blobs in keychain._read_bands(band_paths) for blob in blobs]
+
+        report('CItem', measure(c_items(DictCItem)), measure(c_items(CItem)))
+
+        agile_paths = write_agile_items(path, args.items, args.data_size)
+
+        def a_items(cls):
+            def build():
+                items = []
+                for item_path in agile_paths:
+                    item = cls(None)
+                    item.load_from(item_path)
+                    items.append(item)
+                return items
+            return build
+
+        report('AItem', measure(a_items(DictAItem)), measure(a_items(AItem)))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
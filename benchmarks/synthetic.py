@@ -0,0 +1,85 @@
+"""Write synthetic .cloudkeychain vaults for benchmarking.
+
+Only the pieces of the format that onepassword reads are produced.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import uuid as uuid_mod
+
+import simplejson
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from onepassword import crypt_util
+
+_backend = default_backend()
+
+
+def _aes_encrypt(key, iv, data):
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv), backend=_backend).encryptor()
+    return encryptor.update(data) + encryptor.finalize()
+
+
+def item_key_encrypt(item_key, item_hmac, key, hmac_key):
+    iv = os.urandom(16)
+    msg = iv + _aes_encrypt(key, iv, item_key + item_hmac)
+    return msg + hmac.new(hmac_key, msg, hashlib.sha256).digest()
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def make_cloudkeychain(path, n_items, password='password', iterations=1000, data_size=256):
+    """Create a vault with n_items Login items under path"""
+    default = os.path.join(path, 'default')
+    if not os.path.exists(default):
+        os.makedirs(default)
+    salt = os.urandom(16)
+    derived_key, derived_hmac = crypt_util.opdata1_derive_keys(password, salt, iterations=iterations)
+    bare_master, bare_overview = os.urandom(256), os.urandom(64)
+    master = hashlib.sha512(bare_master).digest()
+    overview = hashlib.sha512(bare_overview).digest()
+    master_key, master_hmac = master[:32], master[32:]
+    overview_key, overview_hmac = overview[:32], overview[32:]
+    profile = {
+        'profileName': 'default',
+        'salt': _b64(salt),
+        'iterations': iterations,
+        'masterKey': _b64(crypt_util.opdata1_encrypt_item(bare_master, derived_key, derived_hmac)),
+        'overviewKey': _b64(crypt_util.opdata1_encrypt_item(bare_overview, derived_key, derived_hmac)),
+    }
+    with open(os.path.join(default, 'profile.js'), 'w') as f:
+        f.write('var profile=%s;' % simplejson.dumps(profile))
+
+    bands = {}
+    for i in range(n_items):
+        uuid = uuid_mod.uuid4().hex.upper()
+        item_key, item_hmac = os.urandom(32), os.urandom(32)
+        overview_data = simplejson.dumps({
+            'title': 'Item %d' % i,
+            'url': 'https://site%d.example.com/login' % i,
+            'tags': ['tag%d' % (i % 10)],
+        }).encode('utf-8')
+        item_data = simplejson.dumps({
+            'fields': [{'name': 'password', 'value': _b64(os.urandom(data_size))}],
+        }).encode('utf-8')
+        blob = {
+            'uuid': uuid,
+            'category': '001',
+            'created': 1325483949 + i,
+            'updated': 1325483949 + i,
+            'tx': 1325483949 + i,
+            'k': _b64(item_key_encrypt(item_key, item_hmac, master_key, master_hmac)),
+            'o': _b64(crypt_util.opdata1_encrypt_item(overview_data, overview_key, overview_hmac)),
+            'd': _b64(crypt_util.opdata1_encrypt_item(item_data, item_key, item_hmac)),
+        }
+        blob['hmac'] = crypt_util.opdata1_overall_hmac(overview_hmac, blob)
+        bands.setdefault(uuid[0], {})[uuid] = blob
+    for band, blobs in bands.items():
+        with open(os.path.join(default, 'band_%s.js' % band), 'w') as f:
+            f.write('ld(%s);' % simplejson.dumps(blobs, indent=2))
+    return path
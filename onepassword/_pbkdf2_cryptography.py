@@ -1,21 +1,32 @@
-from .util import make_utf8
+from .util import make_utf8, parallel_map
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.hashes import SHA1, SHA512
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 _backend = default_backend()
+_sha1 = SHA1()
+_sha512 = SHA512()
 
 
-def pbkdf2_sha1(password, salt, length, iterations):
+def _pbkdf2(algorithm, password, salt, length, iterations):
     password, salt = make_utf8(password, salt)
-    kdf = PBKDF2HMAC(algorithm=SHA1(), length=length, salt=salt,
+    kdf = PBKDF2HMAC(algorithm=algorithm, length=length, salt=salt,
                      iterations=iterations, backend=_backend)
     return kdf.derive(password)
 
 
+def pbkdf2_sha1(password, salt, length, iterations):
+    return _pbkdf2(_sha1, password, salt, length, iterations)
+
+
 def pbkdf2_sha512(password, salt, length, iterations):
-    password, salt = make_utf8(password, salt)
-    kdf = PBKDF2HMAC(algorithm=SHA512(), length=length, salt=salt,
-                     iterations=iterations, backend=_backend)
-    return kdf.derive(password)
+    return _pbkdf2(_sha512, password, salt, length, iterations)
+
+
+def pbkdf2_sha1_batch(jobs, length, max_workers=None):
+    return parallel_map(lambda job: _pbkdf2(_sha1, job[0], job[1], length, job[2]), jobs, max_workers)
+
+
+def pbkdf2_sha512_batch(jobs, length, max_workers=None):
+    return parallel_map(lambda job: _pbkdf2(_sha512, job[0], job[1], length, job[2]), jobs, max_workers)
@@ -1,33 +1,126 @@
 import ctypes
 import ctypes.util
+import threading
+
+from .util import make_utf8, parallel_map
 
 """Simple ctypes wrapper around nettle. Idea came from https://github.com/fredrikt/python-ndnkdf"""
 
 
 _nettle = ctypes.cdll.LoadLibrary(ctypes.util.find_library('nettle'))
-for function in ('nettle_hmac_sha1_update', 'nettle_hmac_sha512_update', 'nettle_hmac_sha1_digest', 'nettle_hmac_sha512_digest', 'nettle_pbkdf2'):
+for function in ('nettle_hmac_sha1_set_key', 'nettle_hmac_sha512_set_key', 'nettle_hmac_sha1_update',
+                 'nettle_hmac_sha512_update', 'nettle_hmac_sha1_digest', 'nettle_hmac_sha512_digest', 'nettle_pbkdf2'):
     if not hasattr(_nettle, function):
         raise ImportError(function)
 
 
-def _pbkdf2(password, salt, length, iterations, hash_size, set_fn, update_fn, digest_fn):
-    buf = ctypes.create_string_buffer(b'', size=max(length, hash_size))
-    # TODO: 1024 bytes is almost definitely not the size of this structure
-    shactx = ctypes.create_string_buffer(b'', size=1024)
-    set_fn(ctypes.byref(shactx), len(password), password)
-    _nettle.nettle_pbkdf2(
-        ctypes.byref(shactx),
-        update_fn,
-        digest_fn,
-        hash_size, int(iterations),
-        len(salt), salt,
-        max(length, hash_size), ctypes.byref(buf))
+# Context layouts from nettle 3.x's sha1.h, sha2.h and hmac.h. nettle 3.10+
+# uses smaller HMAC contexts, so these are an upper bound there.
+class _Sha1Ctx(ctypes.Structure):
+    _fields_ = [
+        ('state', ctypes.c_uint32 * 5),
+        ('count', ctypes.c_uint64),
+        ('index', ctypes.c_uint),
+        ('block', ctypes.c_uint8 * 64),
+    ]
+
+
+class _Sha512Ctx(ctypes.Structure):
+    _fields_ = [
+        ('state', ctypes.c_uint64 * 8),
+        ('count_low', ctypes.c_uint64),
+        ('count_high', ctypes.c_uint64),
+        ('index', ctypes.c_uint),
+        ('block', ctypes.c_uint8 * 128),
+    ]
+
+
+class _HmacSha1Ctx(ctypes.Structure):
+    _fields_ = [('outer', _Sha1Ctx), ('inner', _Sha1Ctx), ('state', _Sha1Ctx)]
+
+
+class _HmacSha512Ctx(ctypes.Structure):
+    _fields_ = [('outer', _Sha512Ctx), ('inner', _Sha512Ctx), ('state', _Sha512Ctx)]
+
+
+# Without argtypes, ctypes passes python ints as C ints, which leaves garbage
+# in the upper half of size_t arguments that end up on the stack.
+for _ctx_type, _name in ((_HmacSha1Ctx, 'sha1'), (_HmacSha512Ctx, 'sha512')):
+    for _op in ('set_key', 'update', 'digest'):
+        _fn = getattr(_nettle, 'nettle_hmac_%s_%s' % (_name, _op))
+        _fn.argtypes = [ctypes.POINTER(_ctx_type), ctypes.c_size_t, ctypes.c_char_p]
+        _fn.restype = None
+_nettle.nettle_pbkdf2.argtypes = [
+    ctypes.c_void_p,  # mac_ctx
+    ctypes.c_void_p,  # update
+    ctypes.c_void_p,  # digest
+    ctypes.c_size_t,  # digest_size
+    ctypes.c_uint,    # iterations
+    ctypes.c_size_t,  # salt_length
+    ctypes.c_char_p,  # salt
+    ctypes.c_size_t,  # length
+    ctypes.c_void_p,  # dst
+]
+_nettle.nettle_pbkdf2.restype = None
+
+
+class _Hash(object):
+    def __init__(self, name, ctx_type, digest_size):
+        self.name = name
+        self.ctx_type = ctx_type
+        self.digest_size = digest_size
+        self.set_key = getattr(_nettle, 'nettle_hmac_%s_set_key' % name)
+        # pbkdf2 wants the raw function pointers
+        self.update = ctypes.cast(getattr(_nettle, 'nettle_hmac_%s_update' % name), ctypes.c_void_p)
+        self.digest = ctypes.cast(getattr(_nettle, 'nettle_hmac_%s_digest' % name), ctypes.c_void_p)
+
+
+_SHA1 = _Hash('sha1', _HmacSha1Ctx, 20)
+_SHA512 = _Hash('sha512', _HmacSha512Ctx, 64)
+
+# HMAC contexts are reset by set_key, so each thread keeps one of each around
+_local = threading.local()
+
+
+def _context(hash):
+    ctx = getattr(_local, hash.name, None)
+    if ctx is None:
+        ctx = hash.ctx_type()
+        setattr(_local, hash.name, ctx)
+    return ctx
+
+
+def _pbkdf2(password, salt, length, iterations, hash):
+    password, salt = make_utf8(password, salt)
+    out_length = max(length, hash.digest_size)
+    buf = ctypes.create_string_buffer(out_length)
+    ctx = _context(hash)
+    try:
+        hash.set_key(ctx, len(password), password)
+        _nettle.nettle_pbkdf2(
+            ctypes.addressof(ctx),
+            hash.update,
+            hash.digest,
+            hash.digest_size, int(iterations),
+            len(salt), salt,
+            out_length, ctypes.addressof(buf))
+    finally:
+        # don't leave password-derived state lying around between calls
+        ctypes.memset(ctypes.addressof(ctx), 0, ctypes.sizeof(ctx))
     return buf.raw[:length]
 
 
 def pbkdf2_sha1(password, salt, length, iterations):
-    return _pbkdf2(password, salt, length, iterations, 20, _nettle.nettle_hmac_sha1_set_key, _nettle.nettle_hmac_sha1_update, _nettle.nettle_hmac_sha1_digest)
+    return _pbkdf2(password, salt, length, iterations, _SHA1)
 
 
 def pbkdf2_sha512(password, salt, length, iterations):
-    return _pbkdf2(password, salt, length, iterations, 64, _nettle.nettle_hmac_sha512_set_key, _nettle.nettle_hmac_sha512_update, _nettle.nettle_hmac_sha512_digest)
+    return _pbkdf2(password, salt, length, iterations, _SHA512)
+
+
+def pbkdf2_sha1_batch(jobs, length, max_workers=None):
+    return parallel_map(lambda job: pbkdf2_sha1(job[0], job[1], length, job[2]), jobs, max_workers)
+
+
+def pbkdf2_sha512_batch(jobs, length, max_workers=None):
+    return parallel_map(lambda job: pbkdf2_sha512(job[0], job[1], length, job[2]), jobs, max_workers)
@@ -0,0 +1,75 @@
+"""asyncio wrappers around AKeychain and CKeychain (Python 3.5+)
+
+File reads, key derivation and decryption are run on an executor (the
+loop's default one unless another is given), so the event loop never waits
+on them. In-memory lookups such as get_by_uuid stay synchronous.
+
+    keychain = await AsyncCKeychain.open(path)
+    await keychain.unlock(password)
+    data = await keychain.decrypt(uuid)
+"""
+import asyncio
+import functools
+
+from .keychain import AKeychain, CKeychain
+
+
+class _AsyncKeychain(object):
+    keychain_class = None
+
+    def __init__(self, keychain, executor=None):
+        self.keychain = keychain
+        self.executor = executor
+
+    @classmethod
+    async def open(cls, path, executor=None, **kwargs):
+        """Construct the wrapped keychain (which checks for files on disk)
+        on the executor. kwargs are passed to the keychain class."""
+        loop = asyncio.get_event_loop()
+        keychain = await loop.run_in_executor(executor, functools.partial(cls.keychain_class, path, **kwargs))
+        return cls(keychain, executor=executor)
+
+    def __getattr__(self, name):
+        # items, items_by_uuid, get_by_uuid, lock, ...
+        return getattr(self.keychain, name)
+
+    def _run(self, fn, *args):
+        return asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(fn, *args))
+
+    def _item(self, item_or_uuid):
+        if isinstance(item_or_uuid, str):
+            return self.keychain.get_by_uuid(item_or_uuid)
+        return item_or_uuid
+
+    async def unlock(self, password):
+        await self._run(self.keychain.unlock, password)
+
+    async def refresh(self):
+        return await self._run(self.keychain.refresh)
+
+    async def decrypt(self, item_or_uuid):
+        """Decrypt an item (or the item with the given uuid)"""
+        return await self._run(self._item(item_or_uuid).decrypt)
+
+    async def decrypt_many(self, items_or_uuids):
+        """Decrypt several items concurrently; results are in input order"""
+        return await asyncio.gather(*[self.decrypt(i) for i in items_or_uuids])
+
+
+class AsyncAKeychain(_AsyncKeychain):
+    keychain_class = AKeychain
+
+    async def load(self, item_or_uuid):
+        """Read a lazily-loaded item's .1password file if it hasn't been yet"""
+        item = self._item(item_or_uuid)
+        await self._run(item.load)
+        return item
+
+
+class AsyncCKeychain(_AsyncKeychain):
+    keychain_class = CKeychain
+
+    async def overview(self, item_or_uuid):
+        """Decrypt (once) and return an item's overview"""
+        item = self._item(item_or_uuid)
+        return await self._run(lambda: item.overview)
@@ -0,0 +1,192 @@
+import collections
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from .util import make_utf8
+
+_clock = getattr(time, 'monotonic', time.time)
+_missing = object()
+
+
+class LRUCache(object):
+    """A thread-safe LRU cache with optional TTL, entry and byte limits
+
+    Arguments:
+        max_entries - evict the least recently used entries beyond this many
+        ttl - entries older than this many seconds are treated as missing
+        max_bytes - evict entries while the sum of sizeof(value) exceeds this
+        sizeof - function returning the size of a value in bytes
+        on_evict - called with each value as it leaves the cache
+        copy - applied to a value, under the cache's lock, before get()
+            returns it; needed when on_evict can change values in place
+        clock - function returning the current time in seconds
+    """
+
+    def __init__(self, max_entries=None, ttl=None, max_bytes=None, sizeof=len, on_evict=None, copy=None,
+                 clock=_clock):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.copy = copy
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _missing, count=False) is not _missing
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.size,
+        }
+
+    def get(self, key, default=None, count=True):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and self.ttl is not None and self.clock() - entry[1] > self.ttl:
+                self._discard(entry)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return default
+            self._entries[key] = entry
+            if count:
+                self.hits += 1
+            if self.copy is not None:
+                return self.copy(entry[0])
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            # would evict everything else and still not fit
+            self.invalidate(key)
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._discard(old)
+            self._entries[key] = (value, self.clock(), size)
+            self.size += size
+            while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and self.size > self.max_bytes)
+            ):
+                _, entry = self._entries.popitem(last=False)
+                self._discard(entry)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._discard(entry)
+
+    def invalidate_matching(self, predicate):
+        """Drop every entry whose key satisfies predicate"""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._discard(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            while self._entries:
+                _, entry = self._entries.popitem()
+                self._discard(entry)
+
+    def _discard(self, entry):
+        self.size -= entry[2]
+        if self.on_evict is not None:
+            self.on_evict(entry[0])
+
+
+def zeroize(buffers):
+    """Overwrite a sequence of bytearrays in place"""
+    for buf in buffers:
+        buf[:] = b'\x00' * len(buf)
+
+
+def copy_buffers(buffers):
+    """A tuple of bytes copies of a sequence of bytearrays"""
+    return tuple(bytes(buf) for buf in buffers)
+
+
+class ItemCache(LRUCache):
+    """LRU cache of decrypted item payloads, bounded by total plaintext size
+
+    Plaintexts are held in bytearrays and overwritten with zeros when they
+    leave the cache, including when the owning keychain is locked.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=None, max_entries=None, clock=_clock):
+        super(ItemCache, self).__init__(
+            max_entries=max_entries,
+            ttl=ttl,
+            max_bytes=max_bytes,
+            on_evict=lambda buf: zeroize((buf,)),
+            copy=bytes,
+            clock=clock,
+        )
+
+    def put(self, key, value):
+        super(ItemCache, self).put(key, bytearray(value))
+
+
+class KeyCache(object):
+    """In-process cache of key material derived from vault passwords
+
+    Entries are keyed on the vault path and a salted HMAC of the password
+    together with the key derivation parameters (salt, iterations, ...), so
+    the password itself is never stored. Keys are held in bytearrays that are
+    overwritten with zeros when they are evicted, invalidated or cleared.
+    """
+
+    def __init__(self, max_entries=32, ttl=300):
+        self._secret = os.urandom(32)
+        self._cache = LRUCache(max_entries=max_entries, ttl=ttl, on_evict=zeroize, copy=copy_buffers)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def stats(self):
+        return self._cache.stats()
+
+    def _key(self, path, password, params):
+        digest = hmac.new(self._secret, make_utf8(password), hashlib.sha256)
+        for param in params:
+            digest.update(b'\x00')
+            digest.update(make_utf8(str(param)))
+        return os.path.realpath(path), digest.digest()
+
+    def get(self, path, password, params):
+        """Return the tuple of keys stored for these arguments, or None"""
+        return self._cache.get(self._key(path, password, params))
+
+    def put(self, path, password, params, keys):
+        self._cache.put(self._key(path, password, params), tuple(bytearray(k) for k in keys))
+
+    def invalidate(self, path):
+        """Forget (and zeroize) every key cached for the vault at path"""
+        path = os.path.realpath(path)
+        self._cache.invalidate_matching(lambda key: key[0] == path)
+
+    def clear(self):
+        self._cache.clear()
@@ -2,18 +2,21 @@ from __future__ import print_function
 
 import base64
 import binascii
+import hashlib
 import math
+import mmap
+import os
 import struct
 
 from . import padding
 from . import pbkdf1
 from . import pbkdf2
-from .util import make_utf8
+from .util import make_utf8, parallel_map
 
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives.hashes import MD5, SHA256, SHA512, Hash
+from cryptography.hazmat.primitives.hashes import SHA256, SHA512, Hash
 from cryptography.hazmat.primitives.hmac import HMAC
 
 _backend = default_backend()
@@ -25,6 +28,9 @@ _backend = default_backend()
 # 16 bytes for mimum cryptext size
 # 32 bytes for HMAC-SHA256
 OPDATA1_MINIMUM_SIZE = 80
+OPDATA1_HEADER_LENGTH = 8
+OPDATA1_TOTAL_HEADER_LENGTH = 32
+OPDATA1_HMAC_LENGTH = 32
 
 
 DEFAULT_PBKDF_ITERATIONS = 1000
@@ -86,60 +92,114 @@ def unhexize(hex_string):
     return ''.join(chr(i) for i in res)
 
 
+class ADecryptor(object):
+    """Decrypts .agilekeychain items encrypted with one level key
+
+    The key's MD5 (for unsalted items) is computed once.
+    """
+
+    def __init__(self, key, aes_size=A_AES_SIZE):
+        self.key = make_utf8(key)
+        self.key_size = KEY_SIZE[aes_size]
+        self._unsalted_key = hashlib.md5(self.key).digest()
+
+    def decrypt_item(self, data):
+        if data[:len(SALT_MARKER)] == SALT_MARKER:
+            pb_gen = pbkdf1.PBKDF1(self.key, data[len(SALT_MARKER):len(SALT_MARKER) + SALT_SIZE])
+            nkey = pb_gen.read(self.key_size)
+            iv = pb_gen.read(self.key_size)
+            data = memoryview(data)[len(SALT_MARKER) + SALT_SIZE:]
+        else:
+            nkey, iv = self._unsalted_key, b'\x00' * self.key_size
+        decryptor = Cipher(algorithms.AES(nkey), modes.CBC(iv), backend=_backend).decryptor()
+        return padding.pkcs5_unpad(decryptor.update(data) + decryptor.finalize())
+
+
 def a_decrypt_item(data, key, aes_size=A_AES_SIZE):
-    key_size = KEY_SIZE[aes_size]
-    if data[:len(SALT_MARKER)] == SALT_MARKER:
-        salt = data[len(SALT_MARKER):len(SALT_MARKER) + SALT_SIZE]
-        data = data[len(SALT_MARKER) + SALT_SIZE:]
-        pb_gen = pbkdf1.PBKDF1(key, salt)
-        nkey = pb_gen.read(key_size)
-        iv = pb_gen.read(key_size)
-    else:
-        digest = Hash(MD5(), backend=_backend)
-        digest.update(key)
-        nkey = digest.finalize()
-        iv = '\x00'*key_size
-
-    aes = Cipher(algorithms.AES(nkey), modes.CBC(iv), backend=_backend)
-    decryptor = aes.decryptor()
-    return padding.pkcs5_unpad(decryptor.update(data) + decryptor.finalize())
+    return ADecryptor(key, aes_size=aes_size).decrypt_item(data)
 
 
-def opdata1_unpack(data):
-    HEADER_LENGTH = 8
-    TOTAL_HEADER_LENGTH = 32
-    HMAC_LENGTH = 32
-    if data[:HEADER_LENGTH] != b"opdata01":
+def _opdata1_view(data):
+    """Return a memoryview over the raw opdata01 record in data (bytes,
+    bytearray, mmap, ...), base64-decoding it first if necessary"""
+    try:
+        view = memoryview(data)
+    except TypeError:
+        view = None
+    if view is None or view[:OPDATA1_HEADER_LENGTH].tobytes() != b"opdata01":
         try:
-            data = base64.b64decode(data)
-        except binascii.Error:
+            view = memoryview(base64.b64decode(data))
+        except (binascii.Error, TypeError):
             raise TypeError("expected opdata1 format message")
-    if data[:HEADER_LENGTH] != b"opdata01":
+    if view[:OPDATA1_HEADER_LENGTH].tobytes() != b"opdata01":
         raise TypeError("expected opdata1 format message")
-    plaintext_length, iv = struct.unpack("<Q16s", data[HEADER_LENGTH:TOTAL_HEADER_LENGTH])
-    cryptext = data[TOTAL_HEADER_LENGTH:-HMAC_LENGTH]
-    expected_hmac = data[-HMAC_LENGTH:]
-    hmac_d_data = data[:-HMAC_LENGTH]
+    return view
+
+
+def opdata1_unpack(data):
+    """Split an opdata01 record into its fields
+
+    cryptext and hmac_d_data are memoryviews into data (or into its base64
+    decoding), so nothing is copied.
+    """
+    view = _opdata1_view(data)
+    plaintext_length, iv = struct.unpack_from("<Q16s", view, OPDATA1_HEADER_LENGTH)
+    cryptext = view[OPDATA1_TOTAL_HEADER_LENGTH:-OPDATA1_HMAC_LENGTH]
+    expected_hmac = view[-OPDATA1_HMAC_LENGTH:].tobytes()
+    hmac_d_data = view[:-OPDATA1_HMAC_LENGTH]
     return plaintext_length, iv, cryptext, expected_hmac, hmac_d_data
 
 
-def opdata1_decrypt_key(data, key, hmac_key, aes_size=C_AES_SIZE, ignore_hmac=False):
-    """Decrypt encrypted item keys"""
-    hmac_key = make_utf8(hmac_key)
-    key_size = KEY_SIZE[aes_size]
-    iv, cryptext, expected_hmac = struct.unpack("=16s64s32s", data)
-    if not ignore_hmac:
-        verifier = HMAC(hmac_key, SHA256(), backend=_backend)
-        verifier.update(iv + cryptext)
+class CDecryptor(object):
+    """Decrypts opdata01 records and item keys made with one (key, hmac_key)
+    pair, as used by .cloudkeychain files
+
+    The AES key and the keyed HMAC state are set up once and reused for
+    every record. Instances can be shared between threads.
+    """
+
+    def __init__(self, key, hmac_key, aes_size=C_AES_SIZE):
+        self.key_size = KEY_SIZE[aes_size]
+        assert len(key) == self.key_size
+        self._algorithm = algorithms.AES(key)
+        self._hmac = HMAC(make_utf8(hmac_key), SHA256(), backend=_backend)
+
+    def _verify(self, signed, expected_hmac, what):
+        verifier = self._hmac.copy()
+        verifier.update(signed)
         try:
             verifier.verify(expected_hmac)
         except InvalidSignature:
-            raise ValueError("HMAC did not match for opdata1 key")
-    aes = Cipher(algorithms.AES(key), modes.CBC(iv), backend=_backend)
-    decryptor = aes.decryptor()
-    decrypted = decryptor.update(cryptext) + decryptor.finalize()
-    crypto_key, mac_key = decrypted[:key_size], decrypted[key_size:]
-    return crypto_key, mac_key
+            raise ValueError("HMAC did not match for %s" % what)
+
+    def _cbc_decrypt(self, iv, cryptext):
+        decryptor = Cipher(self._algorithm, modes.CBC(iv), backend=_backend).decryptor()
+        # update_into wants room for one more block than it will write
+        decrypted = bytearray(len(cryptext) + 15)
+        decrypted_length = decryptor.update_into(cryptext, decrypted)
+        decryptor.finalize()
+        return memoryview(decrypted)[:decrypted_length]
+
+    def decrypt_key(self, data, ignore_hmac=False):
+        """Decrypt an encrypted item key; returns (key, hmac_key)"""
+        iv, cryptext, expected_hmac = struct.unpack("=16s64s32s", data)
+        if not ignore_hmac:
+            self._verify(memoryview(data)[:80], expected_hmac, "opdata1 key")
+        decrypted = self._cbc_decrypt(iv, cryptext)
+        return decrypted[:self.key_size].tobytes(), decrypted[self.key_size:].tobytes()
+
+    def decrypt_item(self, data, ignore_hmac=False):
+        """Decrypt an opdata01 record (see opdata1_unpack for what data can be)"""
+        assert len(data) >= OPDATA1_MINIMUM_SIZE
+        plaintext_length, iv, cryptext, expected_hmac, hmac_d_data = opdata1_unpack(data)
+        if not ignore_hmac:
+            self._verify(hmac_d_data, expected_hmac, "opdata1 record")
+        return padding.ab_unpad(self._cbc_decrypt(iv, cryptext), plaintext_length).tobytes()
+
+
+def opdata1_decrypt_key(data, key, hmac_key, aes_size=C_AES_SIZE, ignore_hmac=False):
+    """Decrypt encrypted item keys"""
+    return CDecryptor(key, hmac_key, aes_size=aes_size).decrypt_key(data, ignore_hmac=ignore_hmac)
 
 
 def opdata1_decrypt_master_key(data, key, hmac_key, aes_size=C_AES_SIZE, ignore_hmac=False):
@@ -154,27 +214,94 @@ def opdata1_decrypt_master_key(data, key, hmac_key, aes_size=C_AES_SIZE, ignore_
 
 
 def opdata1_decrypt_item(data, key, hmac_key, aes_size=C_AES_SIZE, ignore_hmac=False):
+    return CDecryptor(key, hmac_key, aes_size=aes_size).decrypt_item(data, ignore_hmac=ignore_hmac)
+
+
+def opdata1_decrypt_file(path, key, hmac_key, aes_size=C_AES_SIZE, ignore_hmac=False):
+    """Decrypt the opdata01 record stored in the file at path (such as an
+    attachment) by mapping it rather than reading it into memory"""
+    with open(path, 'rb') as f:
+        # the map outlives f; it's unmapped once the last view into it is gone
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return opdata1_decrypt_item(mapped, key, hmac_key, aes_size=aes_size, ignore_hmac=ignore_hmac)
+
+
+def opdata1_decrypt_stream(source, sink, key, hmac_key, aes_size=C_AES_SIZE, ignore_hmac=False,
+                           chunk_size=64 * 1024):
+    """Decrypt a raw (not base64-encoded) opdata01 record from source to sink
+
+    source is a seekable file-like object or mmap, sink anything with a
+    write() method. The HMAC is checked in a first pass over source, and only
+    then is the ciphertext decrypted chunk_size bytes at a time, so memory
+    use doesn't depend on the size of the record. source must not change
+    between the two passes. sink.write() is passed memoryviews into a
+    buffer that is reused for the next chunk. Returns the number of bytes
+    written.
+    """
     key_size = KEY_SIZE[aes_size]
     assert len(key) == key_size
-    assert len(data) >= OPDATA1_MINIMUM_SIZE
-    plaintext_length, iv, cryptext, expected_hmac, hmac_d_data = opdata1_unpack(data)
+    chunk_size = max(chunk_size - chunk_size % 16, 16)
+    source.seek(0, os.SEEK_END)
+    total_length = source.tell()
+    source.seek(0)
+    header = source.read(OPDATA1_TOTAL_HEADER_LENGTH)
+    if header[:OPDATA1_HEADER_LENGTH] != b"opdata01":
+        raise TypeError("expected opdata1 format message")
+    if total_length < OPDATA1_MINIMUM_SIZE:
+        raise ValueError("opdata1 record is too short")
+    plaintext_length, iv = struct.unpack_from("<Q16s", header, OPDATA1_HEADER_LENGTH)
+    cryptext_length = total_length - OPDATA1_TOTAL_HEADER_LENGTH - OPDATA1_HMAC_LENGTH
+    if cryptext_length % 16 or plaintext_length > cryptext_length:
+        raise ValueError("opdata1 record has an invalid length")
     if not ignore_hmac:
         verifier = HMAC(hmac_key, SHA256(), backend=_backend)
-        verifier.update(hmac_d_data)
-        if len(verifier.copy().finalize()) != len(expected_hmac):
-            raise ValueError("Got unexpected HMAC length (expected %d bytes, got %d bytes)" % (
-                len(expected_hmac),
-                len(got_hmac)
-            ))
+        verifier.update(header)
+        remaining = cryptext_length
+        while remaining:
+            chunk = source.read(min(chunk_size, remaining))
+            if not chunk:
+                raise ValueError("opdata1 record was truncated")
+            verifier.update(chunk)
+            remaining -= len(chunk)
         try:
-            verifier.verify(expected_hmac)
+            verifier.verify(source.read(OPDATA1_HMAC_LENGTH))
         except InvalidSignature:
             raise ValueError("HMAC did not match for opdata1 record")
+        source.seek(OPDATA1_TOTAL_HEADER_LENGTH)
     aes = Cipher(algorithms.AES(key), modes.CBC(iv), backend=_backend)
     decryptor = aes.decryptor()
-    decrypted = decryptor.update(cryptext) + decryptor.finalize()
-    unpadded = padding.ab_unpad(decrypted, plaintext_length)
-    return unpadded
+    decrypted = bytearray(chunk_size + 15)
+    decrypted_view = memoryview(decrypted)
+    # the leading bytes of the plaintext are AgileBits random padding
+    to_skip = cryptext_length - plaintext_length
+    remaining = cryptext_length
+    while remaining:
+        chunk = source.read(min(chunk_size, remaining))
+        if not chunk:
+            raise ValueError("opdata1 record was truncated")
+        remaining -= len(chunk)
+        decrypted_length = decryptor.update_into(chunk, decrypted)
+        skipped = min(to_skip, decrypted_length)
+        to_skip -= skipped
+        if decrypted_length > skipped:
+            sink.write(decrypted_view[skipped:decrypted_length])
+    decryptor.finalize()
+    return plaintext_length
+
+
+def opdata1_encrypt_item(data, key, hmac_key, aes_size=C_AES_SIZE, random_generator=os.urandom):
+    """Encrypt data into an opdata01 record (the inverse of opdata1_decrypt_item)"""
+    key_size = KEY_SIZE[aes_size]
+    assert len(key) == key_size
+    iv = random_generator(16)
+    aes = Cipher(algorithms.AES(key), modes.CBC(iv), backend=_backend)
+    encryptor = aes.encryptor()
+    padded = padding.ab_pad(data, random_generator=random_generator)
+    cryptext = encryptor.update(padded) + encryptor.finalize()
+    message = b"opdata01" + struct.pack("<Q", len(data)) + iv + cryptext
+    signer = HMAC(hmac_key, SHA256(), backend=_backend)
+    signer.update(message)
+    return message + signer.finalize()
 
 
 def opdata1_derive_keys(password, salt, iterations=1000, aes_size=C_AES_SIZE):
@@ -190,19 +317,53 @@ def opdata1_derive_keys(password, salt, iterations=1000, aes_size=C_AES_SIZE):
     return key1, key2
 
 
-def opdata1_verify_overall_hmac(hmac_key, item):
-    verifier = HMAC(hmac_key, SHA256(), backend=_backend)
-    for key, value in sorted(item.items()):
+def _overall_hmac_message(item):
+    """What the overall HMAC of an item dictionary is computed over: every
+    key but hmac, each followed by its value, in key order"""
+    parts = []
+    for key in sorted(item):
         if key == 'hmac':
             continue
-        if isinstance(value, bool):
-            value = str(int(value)).encode('utf-8')
+        value = item[key]
+        parts.append(key)
+        if value is True or value is False:
+            parts.append('1' if value else '0')
         else:
-            value = str(value).encode('utf-8')
-        verifier.update(key.encode('utf-8'))
-        verifier.update(value)
-    expected = base64.b64decode(item['hmac'])
-    try:
-        verifier.verify(expected)
-    except InvalidSignature:
-        raise ValueError("HMAC did not match for data dictionary")
+            parts.append(value if isinstance(value, str) else str(value))
+    return ''.join(parts).encode('utf-8')
+
+
+class OverallHMACVerifier(object):
+    """Checks the overall HMACs of .cloudkeychain item dictionaries against
+    one key. The keyed HMAC state is set up once and copied for each item."""
+
+    def __init__(self, hmac_key):
+        self._hmac = HMAC(hmac_key, SHA256(), backend=_backend)
+
+    def verify(self, item):
+        verifier = self._hmac.copy()
+        verifier.update(_overall_hmac_message(item))
+        try:
+            verifier.verify(base64.b64decode(item['hmac']))
+        except InvalidSignature:
+            raise ValueError("HMAC did not match for data dictionary")
+
+    def verify_many(self, items, max_workers=1):
+        """Verify every item, on up to max_workers threads (None for one per
+        CPU); raises ValueError for the first one that doesn't match"""
+        parallel_map(self.verify, items, max_workers)
+
+
+def opdata1_overall_hmac(hmac_key, item):
+    """The base64 'hmac' field for a .cloudkeychain item dictionary"""
+    signer = HMAC(hmac_key, SHA256(), backend=_backend)
+    signer.update(_overall_hmac_message(item))
+    return base64.b64encode(signer.finalize()).decode('ascii')
+
+
+def opdata1_verify_overall_hmac(hmac_key, item):
+    OverallHMACVerifier(hmac_key).verify(item)
+
+
+def opdata1_verify_overall_hmacs(hmac_key, items, max_workers=1):
+    OverallHMACVerifier(hmac_key).verify_many(items, max_workers=max_workers)
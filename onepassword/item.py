@@ -1,5 +1,8 @@
-import simplejson
+import base64
 import datetime
+import os
+
+import simplejson
 
 C_CATEGORIES = {
     '001': 'Login',
@@ -23,9 +26,29 @@ C_CATEGORIES = {
 }
 
 
+def _b64decode(text):
+    return None if text is None else base64.b64decode(text)
+
+
 class AItem(object):
+    """An item of an .agilekeychain
+
+    Only the fields used for listing and decryption are kept (with the
+    encrypted payload base64-decoded); the parsed .1password file is read
+    again, and then kept, the first time data is used.
+    """
+    __slots__ = (
+        'keychain', 'path', 'file_state', 'uuid', 'title', 'category', 'domain', 'updated',
+        '_key_identifier', '_encrypted', '_data',
+    )
+
     def __init__(self, keychain):
         self.keychain = keychain
+        self.path = None
+        self._key_identifier = None
+        self._encrypted = None
+        self._data = None
+        self.file_state = None
 
     @classmethod
     def new_from_file(cls, path, keychain):
@@ -33,36 +56,160 @@ class AItem(object):
         o.load_from(path)
         return o
 
-    def load_from(self, path):
+    @classmethod
+    def new_from_contents(cls, entry, path, keychain):
+        """Build a stub item from a contents.js entry. The item file at path
+        is not read until the item's data is needed."""
+        o = cls(keychain)
+        o.path = path
+        o.uuid, o.category, o.title, o.domain, o.updated = entry[:5]
+        return o
+
+    def _read(self, path):
         with open(path, "r") as f:
             data = simplejson.load(f)
+            st = os.fstat(f.fileno())
+        return data, (st.st_mtime, st.st_size)
+
+    def load_from(self, path):
+        data, self.file_state = self._read(path)
+        self._data = None
+        self.path = path
         self.uuid = data['uuid']
-        self.data = data
-        self.title = self.data['title']
+        self.title = data['title']
+        self.category = data.get('typeName')
+        self.domain = data.get('location', '')
+        self.updated = data.get('updatedAt')
         if 'keyID' in data:
             identifier = data['keyID']
         elif 'securityLevel' in data:
             identifier = self.keychain.levels[data['securityLevel']]
         else:
             raise KeyError("Neither keyID or securityLevel present in %s" % self.uuid)
-        self.key_identifier = identifier
+        self._key_identifier = identifier
+        self._encrypted = base64.b64decode(data['encrypted'])
+
+    def load(self):
+        """Read the item's file if it hasn't been read yet"""
+        if self._encrypted is None:
+            self.load_from(self.path)
+
+    @property
+    def loaded(self):
+        return self._encrypted is not None
+
+    @property
+    def data(self):
+        """The parsed .1password file, read on first use"""
+        if self._data is None:
+            self._data = self._read(self.path)[0]
+        return self._data
+
+    @property
+    def key_identifier(self):
+        self.load()
+        return self._key_identifier
+
+    @property
+    def encrypted(self):
+        self.load()
+        return self._encrypted
+
+    @property
+    def urls(self):
+        return [self.domain] if self.domain else []
+
+    @property
+    def tags(self):
+        return []
 
     def decrypt(self):
-        return simplejson.loads(self.keychain.decrypt(self.key_identifier, self.data['encrypted']))
+        return simplejson.loads(self.keychain.cached_decrypt(self, self._decrypt))
+
+    def _decrypt(self):
+        return self.keychain._decrypt_raw(self.key_identifier, self.encrypted)
 
     def __repr__(self):
-        return '%s<uuid=%s, keyid=%s>' % (self.__class__.__name__, self.uuid, self.key_identifier)
+        return '%s<uuid=%s, keyid=%s>' % (self.__class__.__name__, self.uuid, self._key_identifier)
 
 
 class CItem(object):
+    """An item of a .cloudkeychain
+
+    The overview and item key/data are kept as raw (base64-decoded) bytes,
+    the overview is only decrypted when first used, and updated is kept as
+    an int (updated_at converts it).
+    """
+    __slots__ = ('keychain', 'uuid', 'category_code', 'updated', 'encrypted_overview', '_overview', '_encrypted_data')
+
     def __init__(self, keychain, d):
         self.keychain = keychain
         self.uuid = d['uuid']
-        self.category = C_CATEGORIES[d['category']]
-        self.updated_at = datetime.datetime.fromtimestamp(d['updated'])
-        self.overview = simplejson.loads(self.keychain.decrypt_overview(d['o']))
-        self.title = self.overview['title']
-        self.encrypted_data = d['k'], d['d']
+        self.category_code = d['category']
+        self.updated = d['updated']
+        self.encrypted_overview = _b64decode(d.get('o'))
+        self._overview = None
+        if 'k' in d:
+            self._encrypted_data = _b64decode(d['k']), _b64decode(d['d'])
+        else:
+            self._encrypted_data = None
+
+    @classmethod
+    def new_from_overview(cls, keychain, uuid, category_code, updated, overview):
+        """Build an item from already-decrypted metadata (e.g. from an
+        overview index); its encrypted data is read from the band on use"""
+        o = cls(keychain, {'uuid': uuid, 'category': category_code, 'updated': updated})
+        o._overview = overview
+        return o
+
+    @classmethod
+    def new_from_encrypted(cls, keychain, uuid, category_code, updated, encrypted_overview, key, data):
+        """Build an item from its already base64-decoded overview, item key
+        and data (e.g. from an ItemStore)"""
+        o = cls(keychain, {'uuid': uuid, 'category': category_code, 'updated': updated})
+        o.encrypted_overview = encrypted_overview
+        if key is not None:
+            o._encrypted_data = key, data
+        return o
+
+    @property
+    def category(self):
+        return C_CATEGORIES[self.category_code]
+
+    @property
+    def updated_at(self):
+        return datetime.datetime.fromtimestamp(self.updated)
+
+    @property
+    def encrypted_data(self):
+        if self._encrypted_data is None:
+            self.set_blob(self.keychain.load_blob(self.uuid))
+        return self._encrypted_data
+
+    def set_blob(self, blob):
+        """Take the item key and data from this item's band blob"""
+        self._encrypted_data = _b64decode(blob['k']), _b64decode(blob['d'])
+
+    @property
+    def overview(self):
+        if self._overview is None:
+            self._overview = simplejson.loads(self.keychain._decrypt_overview_raw(self.encrypted_overview))
+        return self._overview
+
+    @property
+    def title(self):
+        return self.overview['title']
+
+    @property
+    def urls(self):
+        urls = [u['u'] for u in self.overview.get('URLs', ()) if u.get('u')]
+        if self.overview.get('url') and self.overview['url'] not in urls:
+            urls.insert(0, self.overview['url'])
+        return urls
+
+    @property
+    def tags(self):
+        return list(self.overview.get('tags', ()))
 
     def __repr__(self):
         return '%s<uuid=%s, cat=%s>' % (
@@ -72,4 +219,7 @@ class CItem(object):
         )
 
     def decrypt(self):
-        return simplejson.loads(self.keychain.decrypt_data(*self.encrypted_data))
+        return simplejson.loads(self.keychain.cached_decrypt(self, self._decrypt))
+
+    def _decrypt(self):
+        return self.keychain._decrypt_data_raw(*self.encrypted_data)
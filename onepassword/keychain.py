@@ -1,21 +1,109 @@
 import base64
+import collections
 import glob
+import itertools
 import os.path
+import re
 
 import simplejson
+import six
 
 from . import crypt_util
+from . import overview_index
 from . import padding
-from .item import AItem, CItem
+from .cache import LRUCache, copy_buffers, zeroize
+from .item import C_CATEGORIES, AItem, CItem
+from .search import SearchIndex
+from .snapshot import Snapshot
+from .store import ItemStore
+from .util import cpu_count
 
 EXPECTED_VERSION_MIN = 30000
 EXPECTED_VERSION_MAX = 40000
 
 
+# the '"uuid": {' introducing each item in a band
+_BAND_KEY_RE = re.compile(br'[\s,]*"[^"\\]*(?:\\.[^"\\]*)*"\s*:\s*\{')
+# the strings and braces of a JSON document
+_BRACE_RE = re.compile(br'"[^"\\]*(?:\\.[^"\\]*)*"|[{}]')
+
+
+def _read_file(path):
+    # read rather than mapped: sync clients rewrite these files in place, and
+    # touching a mapping of a truncated file kills the process with SIGBUS
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _closing_brace(data, start, end):
+    """Offset of the '}' matching the '{' at start, ignoring braces inside
+    strings; -1 if there is none before end"""
+    depth = 0
+    for match in _BRACE_RE.finditer(data, start, end):
+        token = match.group()
+        if token == b'{':
+            depth += 1
+        elif token == b'}':
+            depth -= 1
+            if not depth:
+                return match.start()
+    return -1
+
+
+def _iter_band(path, overview_hmac):
+    """Yield the verified item blobs of a band file one at a time.
+
+    Band files look like ld({"uuid": {...}, ...}); the file is read once and
+    each item is decoded on its own, so the whole band is never held as
+    parsed JSON at the same time.
+    """
+    verifier = crypt_util.OverallHMACVerifier(overview_hmac)
+    data = _read_file(path)
+    pos = data.find(b'{') + 1
+    end = data.rfind(b'}')
+    if pos <= 0 or end < pos:
+        return
+    while True:
+        match = _BAND_KEY_RE.match(data, pos, end)
+        if match is None:
+            break
+        item_start = match.end() - 1
+        item_end = _closing_brace(data, item_start, end)
+        if item_end < 0:
+            raise ValueError("Malformed item at offset %d of %s" % (item_start, path))
+        blob = simplejson.loads(data[item_start:item_end + 1].decode('utf-8'))
+        verifier.verify(blob)
+        yield blob
+        pos = item_end + 1
+    if data[pos:end].strip():
+        raise ValueError("Malformed band file %s at offset %d" % (path, pos))
+
+
+def _stat_file(path):
+    """(mtime, size) of path, or None if it doesn't exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _load_band(path, overview_hmac):
+    """Read a band file and verify each item blob in it.
+
+    Module-level (and only passed plain data) so that it can be shipped to a
+    process pool as well as run on threads.
+    """
+    return list(_iter_band(path, overview_hmac))
+
+
 class _AbstractKeychain(object):
     """Implementation of common keychain logic (MP design, etc)."""
 
-    def __init__(self, path):
+    def __init__(self, path, key_cache=None, item_cache=None):
+        self.key_cache = key_cache
+        self.item_cache = item_cache
+        self._set_items([])
         self._open(path)
 
     def _open(self, path):
@@ -30,15 +118,165 @@ class _AbstractKeychain(object):
     def check_version(self):
         pass
 
+    def _set_items(self, items):
+        """Replace the loaded items and rebuild the lookup indexes"""
+        items_by_uuid = {}
+        items_by_category = {}
+        for item in items:
+            items_by_uuid[item.uuid] = item
+            items_by_category.setdefault(item.category, []).append(item)
+        self.items = items
+        self.items_by_uuid = items_by_uuid
+        self.items_by_category = items_by_category
+        self._items_by_title = None
+        self._search_index = None
+
+    def _update_items(self, new_items, removed):
+        """Add or replace new_items and drop the items with uuids in removed,
+        updating items and the indexes in place"""
+        replacements = dict((item.uuid, item) for item in new_items)
+        removed = set(removed)
+        items = []
+        for item in self.items:
+            if item.uuid not in removed:
+                items.append(replacements.pop(item.uuid, item))
+        items.extend(item for item in new_items if item.uuid in replacements)
+        items_by_category = {}
+        for item in items:
+            items_by_category.setdefault(item.category, []).append(item)
+        self.items[:] = items
+        for uuid in removed:
+            self.items_by_uuid.pop(uuid, None)
+        for item in new_items:
+            self.items_by_uuid[item.uuid] = item
+        for category in list(self.items_by_category):
+            if category not in items_by_category:
+                del self.items_by_category[category]
+        self.items_by_category.update(items_by_category)
+        self._items_by_title = None
+        if self._search_index is not None:
+            for uuid in removed:
+                self._search_index.remove(uuid)
+            for item in new_items:
+                self._search_index.add(item)
+        if self.item_cache is not None:
+            stale = removed | set(item.uuid for item in new_items)
+            self.item_cache.invalidate_matching(lambda key: key[0] == self.base_path and key[1] in stale)
+
+    @property
+    def items_by_title(self):
+        # built on first use, since titles may live in encrypted overviews
+        if self._items_by_title is None:
+            items_by_title = {}
+            for item in self._all_items():
+                items_by_title.setdefault(item.title, []).append(item)
+            self._items_by_title = items_by_title
+        return self._items_by_title
+
+    def _all_items(self):
+        return self.items
+
+    @property
+    def search_index(self):
+        """SearchIndex over every item, built on first use and then kept up
+        to date by refresh()"""
+        if self._search_index is None:
+            self._search_index = SearchIndex(self._all_items())
+        return self._search_index
+
+    def search(self, query, prefix=True):
+        """Items whose title, URL hosts or tags contain every word of query
+        (see SearchIndex.search)"""
+        return [self.get_by_uuid(uuid) for uuid in sorted(self.search_index.search(query, prefix=prefix))]
+
+    def find_by_domain(self, url):
+        """Items with a URL on the host of url or one of its parent domains"""
+        return [self.get_by_uuid(uuid) for uuid in sorted(self.search_index.find_by_domain(url))]
+
+    def lock(self):
+        """Forget the unlocked keys and items, and wipe this keychain's
+        cached plaintext"""
+        if self.item_cache is not None:
+            self.item_cache.invalidate_matching(lambda key: key[0] == self.base_path)
+        self._set_items([])
+
+    def cached_decrypt(self, item, decrypt):
+        """Return decrypt()'s plaintext for item, going through item_cache"""
+        if self.item_cache is None:
+            return decrypt()
+        key = (self.base_path, item.uuid, item.updated)
+        plaintext = self.item_cache.get(key)
+        if plaintext is None:
+            plaintext = decrypt()
+            self.item_cache.put(key, plaintext)
+        return plaintext
+
+    def decrypt_many(self, items, executor=None, max_workers=None, window=64):
+        """Decrypt many items (or uuids), yielding (item, data) pairs in
+        input order.
+
+        The decryption runs on executor, or else on a thread pool of
+        max_workers threads (default: one per CPU), with at most window
+        items in flight at once. max_workers=1, or concurrent.futures being
+        unavailable, decrypts serially.
+        """
+        items = (self.get_by_uuid(i) if isinstance(i, six.string_types) else i for i in items)
+        if executor is None:
+            if max_workers is None:
+                max_workers = cpu_count()
+            ThreadPoolExecutor = None
+            if max_workers > 1:
+                try:
+                    from concurrent.futures import ThreadPoolExecutor
+                except ImportError:
+                    pass
+            if ThreadPoolExecutor is None:
+                for item in items:
+                    yield item, item.decrypt()
+                return
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for result in self.decrypt_many(items, executor=executor, window=window):
+                    yield result
+            return
+        pending = collections.deque()
+        for item in items:
+            pending.append((item, executor.submit(item.decrypt)))
+            if len(pending) >= window:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+    def decrypt_all(self, **kwargs):
+        """decrypt_many() over every loaded item"""
+        return self.decrypt_many(list(self._all_items()), **kwargs)
+
     def get_by_uuid(self, uuid):
-        try:
-            return [i for i in self.items if i.uuid == uuid][0]
-        except Exception:
-            raise KeyError(uuid)
+        return self.items_by_uuid[uuid]
+
+    def get_by_title(self, title):
+        return list(self.items_by_title.get(title, []))
+
+    def get_by_category(self, category):
+        return list(self.items_by_category.get(category, []))
 
 
 class AKeychain(_AbstractKeychain):
-    """Implementation of the classic .agilekeychain storage format"""
+    """Implementation of the classic .agilekeychain storage format
+
+    With lazy=True, unlocking only reads contents.js; each item's .1password
+    file is read the first time its data is needed.
+    """
+
+    DATA_DIR = ('data', 'default')
+    KEY_FILES = ('encryptionKeys.js',)
+
+    def __init__(self, path, lazy=False, key_cache=None, item_cache=None):
+        self.lazy = lazy
+        self.keys = {}
+        self._decryptors = {}
+        super(AKeychain, self).__init__(path, key_cache=key_cache, item_cache=item_cache)
 
     def check_paths(self):
         super(AKeychain, self).check_paths()
@@ -75,31 +313,153 @@ class AKeychain(_AbstractKeychain):
         for level, identifier in levels.items():
             keys = [k for k in data['list'] if k.get('identifier') == identifier]
             assert len(keys) == 1, "There should be exactly one key for level %s, got %d" % (level, len(keys))
-            key = keys[0]
-            self.keys[identifier] = crypt_util.a_decrypt_key(key, password)
+            self.keys[identifier] = self._decrypt_level_key(keys[0], password)
+        self._decryptors = dict((identifier, crypt_util.ADecryptor(key)) for identifier, key in self.keys.items())
         self.levels = levels
 
+    def _decrypt_level_key(self, key, password):
+        if self.key_cache is None:
+            return crypt_util.a_decrypt_key(key, password)
+        params = (key.get('identifier'), key.get('iterations'), key['data'], key['validation'])
+        cached = self.key_cache.get(self.base_path, password, params)
+        if cached is not None:
+            return cached[0]
+        level_key = crypt_util.a_decrypt_key(key, password)
+        self.key_cache.put(self.base_path, password, params, (level_key,))
+        return level_key
+
+    def lock(self):
+        super(AKeychain, self).lock()
+        self.keys = {}
+        self._decryptors = {}
+
     def _load_items(self, keys):
+        if self.lazy:
+            items = self._load_item_stubs()
+        else:
+            items = []
+            for f in glob.glob(os.path.join(self.base_path, 'data', 'default', '*.1password')):
+                items.append(AItem.new_from_file(f, self))
+        self._set_items(items)
+
+    def _item_path(self, uuid):
+        return os.path.join(self.base_path, 'data', 'default', '%s.1password' % uuid)
+
+    def _read_contents(self):
+        path = os.path.join(self.base_path, 'data', 'default', 'contents.js')
+        if not self.lazy and not os.path.exists(path):
+            return []
+        with open(path, 'r') as f:
+            return simplejson.load(f)
+
+    def _load_item_stubs(self):
         items = []
-        for f in glob.glob(os.path.join(self.base_path, 'data', 'default', '*.1password')):
-            items.append(AItem.new_from_file(f, self))
-        self.items = items
+        for entry in self._read_contents():
+            items.append(AItem.new_from_contents(entry, self._item_path(entry[0]), self))
+        return items
+
+    def refresh(self):
+        """Reload only the items that were added, changed or removed since the
+        last unlock or refresh, keeping the decrypted level keys.
+
+        Items are listed from contents.js in lazy mode and from the
+        .1password files otherwise. An item counts as changed if its
+        contents.js timestamp moved, or if its file was read and has since
+        been modified. Returns a tuple of lists of (added, updated, removed)
+        uuids.
+        """
+        entries = dict((entry[0], entry) for entry in self._read_contents())
+        if self.lazy:
+            listed = entries
+        else:
+            listed = dict(
+                (os.path.basename(path)[:-len('.1password')], None)
+                for path in glob.glob(os.path.join(self.base_path, 'data', 'default', '*.1password'))
+            )
+        added, updated, new_items, vanished = [], [], [], set()
+        for uuid in sorted(listed):
+            existing = self.items_by_uuid.get(uuid)
+            entry = entries.get(uuid)
+            if existing is None:
+                changes = added
+            elif entry is not None and entry[4] != existing.updated:
+                changes = updated
+            elif existing.file_state is not None and _stat_file(existing.path) != existing.file_state:
+                changes = updated
+            else:
+                continue
+            if self.lazy:
+                item = AItem.new_from_contents(entry, self._item_path(uuid), self)
+            else:
+                try:
+                    item = AItem.new_from_file(self._item_path(uuid), self)
+                except (IOError, OSError):
+                    # deleted since we listed it
+                    vanished.add(uuid)
+                    continue
+            changes.append(uuid)
+            new_items.append(item)
+        removed = [item.uuid for item in self.items if item.uuid not in listed or item.uuid in vanished]
+        self._update_items(new_items, removed)
+        return added, updated, removed
 
     def decrypt(self, keyid, string):
-        if keyid not in self.keys:
+        """Decrypt an item's base64-encoded encrypted data"""
+        return self._decrypt_raw(keyid, base64.b64decode(string))
+
+    def _decrypt_raw(self, keyid, data):
+        # for data that is already base64-decoded (as AItem keeps it)
+        if keyid not in self._decryptors:
             raise ValueError("Item encrypted with unknown key %s" % keyid)
-        string = base64.b64decode(string)
-        return crypt_util.a_decrypt_item(string, self.keys[keyid])
+        return self._decryptors[keyid].decrypt_item(data)
 
 
 class CKeychain(_AbstractKeychain):
     """Implementation of the modern .cloudkeychain format
 
     Documentation at http://learn.agilebits.com/1Password4/Security/keychain-design.html
+
+    If an executor (e.g. a concurrent.futures ThreadPoolExecutor or
+    ProcessPoolExecutor) is passed, band files are read and verified on it
+    concurrently. The resulting items are the same as with the serial loader.
+
+    Unwrapped per-item keys are memoized for up to item_key_cache_size items
+    (pass 0 to disable) and wiped when the keychain is locked.
+
+    If index_path is given, an encrypted overview index is kept there (see
+    onepassword.overview_index). While it matches the band files, unlocking
+    reads only the index; band files are then read on the first decrypt().
+
+    With columnar=True, unlocking fills an ItemStore (see onepassword.store)
+    instead of creating an item object per item. items, items_by_uuid and
+    items_by_category then stay empty; the get_by_* methods, decrypt_all and
+    search go through store, which creates items as they are asked for.
+
+    freeze() packs the loaded items into a Snapshot (see onepassword.snapshot)
+    that processes forked afterwards share without copying; refresh() then
+    builds a new snapshot rather than patching it.
     """
 
     INITIAL_KEY_OFFSET = 12
     KEY_SIZE = 32
+    DATA_DIR = ('default',)
+    KEY_FILES = ('profile.js',)
+
+    def __init__(self, path, executor=None, key_cache=None, item_cache=None, item_key_cache_size=1024,
+                 index_path=None, columnar=False):
+        self.executor = executor
+        self.index_path = index_path
+        self.columnar = columnar
+        self.store = None
+        self.frozen = False
+        self._band_state = {}
+        self._band_uuids = {}
+        self.master_key = self.master_hmac = self.overview_key = self.overview_hmac = None
+        self._master_decryptor = self._overview_decryptor = None
+        self.item_key_cache = None
+        if item_key_cache_size:
+            self.item_key_cache = LRUCache(max_entries=item_key_cache_size, on_evict=zeroize, copy=copy_buffers)
+        super(CKeychain, self).__init__(path, key_cache=key_cache, item_cache=item_cache)
 
     def check_paths(self):
         super(CKeychain, self).check_paths()
@@ -111,68 +471,275 @@ class CKeychain(_AbstractKeychain):
                 raise Exception("Missing %s, expected at %s" % (descriptor, expected_path))
 
     def unlock(self, password):
+        if self.item_key_cache is not None:
+            self.item_key_cache.clear()
         self._load_keys(password)
         self._load_items()
 
     def _load_keys(self, password):
-        with open(os.path.join(self.base_path, 'default', 'profile.js'), 'r') as f:
-            ds = f.read()[self.INITIAL_KEY_OFFSET:-1]
-            data = simplejson.loads(ds)
+        profile = _read_file(os.path.join(self.base_path, 'default', 'profile.js'))
+        data = simplejson.loads(profile[self.INITIAL_KEY_OFFSET:len(profile) - 1].decode('utf-8'))
+        if self.key_cache is None:
+            keys = self._derive_keys(password, data)
+        else:
+            params = (data['salt'], data['iterations'], data['masterKey'], data['overviewKey'])
+            keys = self.key_cache.get(self.base_path, password, params)
+            if keys is None:
+                keys = self._derive_keys(password, data)
+                self.key_cache.put(self.base_path, password, params, keys)
+        self.master_key, self.master_hmac, self.overview_key, self.overview_hmac = keys
+        self._master_decryptor = crypt_util.CDecryptor(self.master_key, self.master_hmac)
+        self._overview_decryptor = crypt_util.CDecryptor(self.overview_key, self.overview_hmac)
+
+    def lock(self):
+        super(CKeychain, self).lock()
+        if self.item_key_cache is not None:
+            self.item_key_cache.clear()
+        self._band_state = {}
+        self._band_uuids = {}
+        self.store = None
+        self.frozen = False
+        self.master_key = self.master_hmac = self.overview_key = self.overview_hmac = None
+        self._master_decryptor = self._overview_decryptor = None
+
+    def _derive_keys(self, password, data):
         super_master_key, super_hmac_key = crypt_util.opdata1_derive_keys(
             password,
             base64.b64decode(data['salt']),
             iterations=int(data['iterations'])
         )
-        self.master_key, self.master_hmac = crypt_util.opdata1_decrypt_master_key(
+        master_key, master_hmac = crypt_util.opdata1_decrypt_master_key(
             base64.b64decode(data['masterKey']),
             super_master_key,
             super_hmac_key
         )
-        self.overview_key, self.overview_hmac = crypt_util.opdata1_decrypt_master_key(
+        overview_key, overview_hmac = crypt_util.opdata1_decrypt_master_key(
             base64.b64decode(data['overviewKey']),
             super_master_key,
             super_hmac_key
         )
+        return master_key, master_hmac, overview_key, overview_hmac
 
-    def _load_items(self):
-        items = []
-        items_by_category = {}
+    def _band_paths(self):
+        paths = []
         for band in range(0, 15):
             band = hex(band)[-1:].upper()
             path = os.path.join(self.base_path, 'default', 'band_%s.js' % band)
-            if not os.path.exists(path):
-                continue
-            with open(path) as f:
-                items.extend(self._load_band_file(f))
-        for item in items:
-            items_by_category.setdefault(item.category, [])
-            items_by_category[item.category].append(item)
-        self.items = items
-        self.items_by_category = items_by_category
+            if os.path.exists(path):
+                paths.append(path)
+        return paths
+
+    def _read_bands(self, paths):
+        """Yield the verified blobs of each band in paths, in order"""
+        if self.executor is None:
+            return (_iter_band(path, self.overview_hmac) for path in paths)
+        return self.executor.map(_load_band, paths, [self.overview_hmac] * len(paths))
+
+    def _load_items(self):
+        paths = self._band_paths()
+        # stat before reading, so that a write racing with us is seen by refresh()
+        band_state = dict((path, _stat_file(path)) for path in paths)
+        if self.columnar or self.frozen:
+            self._band_state = band_state
+            self.store = ItemStore.from_blobs(self, itertools.chain.from_iterable(self._read_bands(paths)))
+            if self.frozen:
+                self.store = Snapshot.from_store(self.store)
+            self._search_index = None
+            self._items_by_title = None
+            return
+        if self.index_path is not None and self._load_index(paths, band_state):
+            return
+        self._band_state = band_state
+        self._band_uuids = {}
+        items = []
+        for path, blobs in zip(paths, self._read_bands(paths)):
+            band_items = [CItem(self, blob) for blob in blobs]
+            self._band_uuids[path] = [item.uuid for item in band_items]
+            items.extend(band_items)
+        self._set_items(items)
+        if self.index_path is not None:
+            self._write_index()
 
-    def _load_band_file(self, f):
+    def _load_index(self, paths, band_state):
+        index = overview_index.read(self.index_path, self.overview_key, self.overview_hmac)
+        if index is None or not overview_index.is_current(index, band_state):
+            return False
+        self._band_state = band_state
+        self._band_uuids = {}
         items = []
-        band_data = simplejson.loads(f.read()[3:-2])
-        for uuid, blob in band_data.items():
-            crypt_util.opdata1_verify_overall_hmac(self.overview_hmac, blob)
-            items.append(CItem(self, blob))
+        for path in paths:
+            band_items = [
+                CItem.new_from_overview(self, uuid, category_code, updated, overview)
+                for uuid, category_code, updated, overview in index['bands'][os.path.basename(path)]['items']
+            ]
+            self._band_uuids[path] = [item.uuid for item in band_items]
+            items.extend(band_items)
+        self._set_items(items)
+        return True
+
+    def _write_index(self):
+        try:
+            overview_index.write(
+                self.index_path,
+                self.overview_key,
+                self.overview_hmac,
+                self._band_state,
+                self._band_uuids,
+                self.items_by_uuid,
+            )
+        except (IOError, OSError):
+            # the index is only an optimization; the next unlock will do a
+            # full load and try again
+            pass
+
+    def load_blob(self, uuid):
+        """Read the verified blob for one item from its band file
+
+        The other items of that band that don't have their data yet (those
+        loaded from the overview index) get it from the same pass, so each
+        band is read at most once.
+        """
+        found = None
+        for path, uuids in self._band_uuids.items():
+            if uuid not in uuids:
+                continue
+            for blob in _iter_band(path, self.overview_hmac):
+                if blob['uuid'] == uuid:
+                    found = blob
+                    continue
+                item = self.items_by_uuid.get(blob['uuid'])
+                if item is None or item._encrypted_data is not None:
+                    continue
+                if 'k' in blob and item.updated == blob['updated']:
+                    item.set_blob(blob)
+            if found is not None:
+                return found
+        raise KeyError(uuid)
+
+    def refresh(self):
+        """Re-read only the band files that changed since the last unlock or
+        refresh, and update items and the indexes in place.
+
+        Returns a tuple of lists of (added, updated, removed) uuids.
+        """
+        state = dict((path, _stat_file(path)) for path in self._band_paths())
+        changed = [path for path, st in sorted(state.items()) if st is not None and self._band_state.get(path) != st]
+        gone = [path for path in self._band_state if state.get(path) is None]
+        if self.store is not None:
+            return self._refresh_store(changed or gone)
+        added, updated, new_items = [], [], []
+        band_uuids = {}
+        for path, blobs in zip(changed, self._read_bands(changed)):
+            band_uuids[path] = []
+            for blob in blobs:
+                uuid = blob['uuid']
+                band_uuids[path].append(uuid)
+                existing = self.items_by_uuid.get(uuid)
+                if existing is None:
+                    added.append(uuid)
+                elif existing.updated != blob['updated']:
+                    updated.append(uuid)
+                else:
+                    continue
+                new_items.append(CItem(self, blob))
+        seen = set(uuid for uuids in band_uuids.values() for uuid in uuids)
+        removed = [
+            uuid for path in changed + gone for uuid in self._band_uuids.get(path, ()) if uuid not in seen
+        ]
+        for path in gone:
+            self._band_state.pop(path, None)
+            self._band_uuids.pop(path, None)
+        for path in changed:
+            self._band_state[path] = state[path]
+        self._band_uuids.update(band_uuids)
+        self._update_items(new_items, removed)
+        if self.index_path is not None and (changed or gone):
+            self._write_index()
+        return added, updated, removed
+
+    def _refresh_store(self, stale):
+        # the arena can't be patched in place, so any change rebuilds it
+        if not stale:
+            return [], [], []
+        before = self.store.updated_by_uuid()
+        self._load_items()
+        after = self.store.updated_by_uuid()
+        added = sorted(uuid for uuid in after if uuid not in before)
+        updated = sorted(uuid for uuid in after if uuid in before and after[uuid] != before[uuid])
+        removed = sorted(uuid for uuid in before if uuid not in after)
+        if self.item_cache is not None:
+            changes = set(updated) | set(removed)
+            self.item_cache.invalidate_matching(lambda key: key[0] == self.base_path and key[1] in changes)
+        return added, updated, removed
+
+    def freeze(self):
+        """Move the loaded items into a Snapshot, to be shared by processes
+        forked from this one. items and the items_by_* indexes are emptied;
+        lookups go through store, as with columnar=True."""
+        if self.store is not None:
+            self.store = Snapshot.from_store(self.store)
+        else:
+            self.store = Snapshot.freeze(self, self._items_with_blobs())
+        self.frozen = True
+        self._set_items([])
+        self._band_uuids = {}
+
+    def _items_with_blobs(self):
+        """The loaded items, with those loaded from the overview index (which
+        carry neither their encrypted overview nor their data) replaced by
+        items built from their blobs, reading each band at most once"""
+        items = list(self.items)
+        positions = dict(
+            (item.uuid, i) for i, item in enumerate(items)
+            if item.encrypted_overview is None and item._overview is not None
+        )
+        for path, uuids in self._band_uuids.items():
+            if not any(uuid in positions for uuid in uuids):
+                continue
+            for blob in _iter_band(path, self.overview_hmac):
+                if blob['uuid'] in positions:
+                    items[positions[blob['uuid']]] = CItem(self, blob)
         return items
 
+    def _all_items(self):
+        if self.store is not None:
+            return self.store.items()
+        return self.items
+
+    def get_by_uuid(self, uuid):
+        if self.store is not None:
+            return self.store.get_by_uuid(uuid)
+        return super(CKeychain, self).get_by_uuid(uuid)
+
+    def get_by_category(self, category):
+        if self.store is not None:
+            codes = [code for code, name in C_CATEGORIES.items() if name == category]
+            return list(self.store.items(self.store.rows(category_code=codes[0]))) if codes else []
+        return super(CKeychain, self).get_by_category(category)
+
     def decrypt_overview(self, blob):
-        return crypt_util.opdata1_decrypt_item(
-            base64.b64decode(blob),
-            self.overview_key,
-            self.overview_hmac
-        )
+        return self._decrypt_overview_raw(base64.b64decode(blob))
+
+    def decrypt_item_key(self, key_blob):
+        return self._decrypt_item_key_raw(base64.b64decode(key_blob))
 
     def decrypt_data(self, key_blob, data_blob):
-        key, hmac = crypt_util.opdata1_decrypt_key(
-            base64.b64decode(key_blob),
-            self.master_key,
-            self.master_hmac
-        )
-        return crypt_util.opdata1_decrypt_item(
-            base64.b64decode(data_blob),
-            key,
-            hmac
-        )
+        return self._decrypt_data_raw(base64.b64decode(key_blob), base64.b64decode(data_blob))
+
+    # the same, for blobs that are already base64-decoded (as CItem keeps them)
+    def _decrypt_overview_raw(self, blob):
+        return self._overview_decryptor.decrypt_item(blob)
+
+    def _decrypt_item_key_raw(self, key_blob):
+        if self.item_key_cache is not None:
+            keys = self.item_key_cache.get(key_blob)
+            if keys is not None:
+                return keys
+        key, hmac = self._master_decryptor.decrypt_key(key_blob)
+        if self.item_key_cache is not None:
+            self.item_key_cache.put(key_blob, (bytearray(key), bytearray(hmac)))
+        return key, hmac
+
+    def _decrypt_data_raw(self, key_blob, data_blob):
+        key, hmac = self._decrypt_item_key_raw(key_blob)
+        return crypt_util.opdata1_decrypt_item(data_blob, key, hmac)
@@ -0,0 +1,68 @@
+"""Encrypted on-disk cache of a .cloudkeychain's decrypted overviews
+
+The index records, for every item, its uuid, category, updated timestamp,
+band and decrypted overview (title, URLs, tags, ...), together with the
+(mtime, size) of every band file it was built from. It is stored as a
+single opdata01 record under the vault's overview key, so it is as well
+protected as the overviews in the bands themselves.
+
+A CKeychain given an index_path uses the index instead of reading the
+bands when every band still matches, and rewrites it after a full load.
+"""
+import os
+import tempfile
+
+import simplejson
+
+from . import crypt_util
+
+INDEX_VERSION = 1
+
+
+def write(path, overview_key, overview_hmac, band_state, band_uuids, items_by_uuid):
+    """Atomically write an index of the given items to path
+
+    band_state maps band paths to their (mtime, size), band_uuids maps band
+    paths to the uuids they contain.
+    """
+    bands = {}
+    for band_path, state in band_state.items():
+        items = [items_by_uuid[uuid] for uuid in band_uuids.get(band_path, ())]
+        bands[os.path.basename(band_path)] = {
+            'state': state and list(state),
+            'items': [[item.uuid, item.category_code, item.updated, item.overview] for item in items],
+        }
+    plaintext = simplejson.dumps({'version': INDEX_VERSION, 'bands': bands}).encode('utf-8')
+    record = crypt_util.opdata1_encrypt_item(plaintext, overview_key, overview_hmac)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.overview-index-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(record)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def read(path, overview_key, overview_hmac):
+    """Return the decrypted index at path, or None if it is missing,
+    corrupt, from another version, or not encrypted with these keys"""
+    try:
+        with open(path, 'rb') as f:
+            record = f.read()
+    except (IOError, OSError):
+        return None
+    try:
+        index = simplejson.loads(crypt_util.opdata1_decrypt_item(record, overview_key, overview_hmac).decode('utf-8'))
+    except (AssertionError, TypeError, ValueError):
+        return None
+    if not isinstance(index, dict) or index.get('version') != INDEX_VERSION:
+        return None
+    return index
+
+
+def is_current(index, band_state):
+    """Whether the index was built from exactly these band files"""
+    current = dict((os.path.basename(path), state and list(state)) for path, state in band_state.items())
+    return current == dict((name, band['state']) for name, band in index['bands'].items())
@@ -41,7 +41,7 @@ def ab_unpad(string, plaintext_size):
     """AgileBits custom unpad a string with the given known plaintext size
 
     Arguments:
-        string - The string to unpad
+        string - The string to unpad; slicing a memoryview doesn't copy
         plaintext_size - The target length in bytes
     """
     return string[len(string)-plaintext_size:]
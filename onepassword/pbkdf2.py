@@ -1,12 +1,24 @@
+"""PBKDF2 entry points, backed by nettle if it can be loaded and by
+cryptography otherwise.
+
+pbkdf2_sha1 / pbkdf2_sha512 take (password, salt, length, iterations).
+The *_batch variants take a list of (password, salt, iterations) tuples and
+a length, spread the work over up to max_workers threads (both backends
+release the GIL while deriving) and return the keys in input order.
+"""
 from __future__ import absolute_import
 
 try:
-    from ._pbkdf2_nettle import pbkdf2_sha1, pbkdf2_sha512
+    from ._pbkdf2_nettle import pbkdf2_sha1, pbkdf2_sha512, pbkdf2_sha1_batch, pbkdf2_sha512_batch
     # make pyflakes happy
     pbkdf2_sha1 = pbkdf2_sha1
     pbkdf2_sha512 = pbkdf2_sha512
+    pbkdf2_sha1_batch = pbkdf2_sha1_batch
+    pbkdf2_sha512_batch = pbkdf2_sha512_batch
 except ImportError:
-    from ._pbkdf2_cryptography import pbkdf2_sha1, pbkdf2_sha512
+    from ._pbkdf2_cryptography import pbkdf2_sha1, pbkdf2_sha512, pbkdf2_sha1_batch, pbkdf2_sha512_batch
     # make pyflakes happy
     pbkdf2_sha1 = pbkdf2_sha1
     pbkdf2_sha512 = pbkdf2_sha512
+    pbkdf2_sha1_batch = pbkdf2_sha1_batch
+    pbkdf2_sha512_batch = pbkdf2_sha512_batch
@@ -0,0 +1,118 @@
+"""In-memory search index over item titles, URLs and tags
+
+For a CKeychain these come from the decrypted overviews, for an AKeychain
+from contents.js (title and domain). The index only ever lives in memory.
+
+Words are looked up in a dict of postings, and prefixes by bisecting a
+sorted list of the indexed words. Hosts are kept in a separate dict so
+that find_by_domain costs one lookup per label of the host.
+"""
+import bisect
+import re
+
+from six.moves.urllib.parse import urlsplit
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Lower-cased words of text"""
+    return _WORD_RE.findall(text.lower())
+
+
+def host_of(url):
+    """The lower-cased host of a URL (or bare domain), without any leading www."""
+    if '//' not in url:
+        url = '//' + url
+    try:
+        host = urlsplit(url.strip()).hostname or ''
+    except ValueError:
+        return ''
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+class SearchIndex(object):
+    def __init__(self, items=()):
+        self._postings = {}
+        self._words = []
+        self._hosts = {}
+        self._entries = {}
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, uuid):
+        return uuid in self._entries
+
+    def add(self, item):
+        """Index item, replacing whatever was indexed under its uuid"""
+        self.remove(item.uuid)
+        words = set(tokenize(item.title or ''))
+        hosts = set()
+        for url in item.urls:
+            host = host_of(url)
+            if host:
+                hosts.add(host)
+                words.update(tokenize(host))
+        for tag in item.tags:
+            words.update(tokenize(tag))
+        for word in words:
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = set()
+                bisect.insort(self._words, word)
+            postings.add(item.uuid)
+        for host in hosts:
+            self._hosts.setdefault(host, set()).add(item.uuid)
+        self._entries[item.uuid] = (words, hosts)
+
+    def remove(self, uuid):
+        entry = self._entries.pop(uuid, None)
+        if entry is None:
+            return
+        words, hosts = entry
+        for word in words:
+            postings = self._postings[word]
+            postings.discard(uuid)
+            if not postings:
+                del self._postings[word]
+                del self._words[bisect.bisect_left(self._words, word)]
+        for host in hosts:
+            uuids = self._hosts[host]
+            uuids.discard(uuid)
+            if not uuids:
+                del self._hosts[host]
+
+    def _prefixed(self, prefix):
+        uuids = set()
+        start = bisect.bisect_left(self._words, prefix)
+        for word in self._words[start:]:
+            if not word.startswith(prefix):
+                break
+            uuids |= self._postings[word]
+        return uuids
+
+    def search(self, query, prefix=True):
+        """uuids of the items matching every word of query. With prefix, a
+        query word also matches indexed words it is the start of."""
+        result = None
+        for word in tokenize(query):
+            uuids = self._prefixed(word) if prefix else self._postings.get(word, set())
+            result = uuids if result is None else result & uuids
+            if not result:
+                break
+        return result or set()
+
+    def find_by_domain(self, url):
+        """uuids of the items with a URL on the host of url or on one of its
+        parent domains (so login.example.com finds example.com items)"""
+        labels = host_of(url).split('.')
+        uuids = set()
+        # stop short of the bare top-level domain
+        for i in range(max(len(labels) - 1, 1)):
+            uuids |= self._hosts.get('.'.join(labels[i:]), set())
+        return uuids
@@ -0,0 +1,284 @@
+"""Serve an unlocked keychain to other local processes over a Unix socket
+
+One process (the daemon) unlocks the keychain and holds the keys; workers
+talk to it through a KeychainClient instead of each unlocking the vault
+themselves.
+
+    python -m onepassword.server --socket /run/onepassword.sock path/to/vault.cloudkeychain
+
+    client = KeychainClient('/run/onepassword.sock')
+    data = client.decrypt(client.find_by_domain('https://example.com/')[0]['uuid'])
+
+Every message is a 4-byte big-endian length followed by that many bytes.
+Requests are a 1-byte opcode followed by the argument (a uuid, query or
+URL, UTF-8 encoded); responses are a 1-byte status followed by a JSON body
+(or an error message). A connection carries any number of requests.
+Decrypted items are already JSON documents, so the bodies stay JSON rather
+than a binary encoding of our own; any language's client can read them.
+"""
+from __future__ import print_function
+
+import argparse
+import getpass
+import os
+import socket
+import stat
+import struct
+import threading
+
+import simplejson
+import six
+from six.moves import queue, socketserver
+
+OP_LIST = 1
+OP_GET = 2
+OP_DECRYPT = 3
+OP_SEARCH = 4
+OP_FIND_BY_DOMAIN = 5
+OP_REFRESH = 6
+
+STATUS_OK = 0
+STATUS_NOT_FOUND = 1
+STATUS_ERROR = 2
+
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+_LENGTH = struct.Struct('>I')
+
+
+class KeychainServerError(Exception):
+    pass
+
+
+class _NotFound(Exception):
+    pass
+
+
+def _recv_exactly(sock, length):
+    chunks = []
+    while length:
+        chunk = sock.recv(min(length, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    """Read one framed message; None if the peer closed the connection"""
+    header = _recv_exactly(sock, _LENGTH.size)
+    if header is None:
+        return None
+    length, = _LENGTH.unpack(header)
+    if length > MAX_MESSAGE_SIZE:
+        raise KeychainServerError("Message of %d bytes is too large" % length)
+    if not length:
+        return b''
+    message = _recv_exactly(sock, length)
+    if message is None:
+        raise KeychainServerError("Connection closed mid-message")
+    return message
+
+
+def send_message(sock, message):
+    sock.sendall(_LENGTH.pack(len(message)) + message)
+
+
+def _summary(item):
+    return {
+        'uuid': item.uuid,
+        'title': item.title,
+        'category': item.category,
+        'updated': item.updated,
+        'urls': item.urls,
+        'tags': item.tags,
+    }
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (KeychainServerError, socket.error):
+                return
+            if not request:
+                return
+            send_message(self.request, self.server.dispatch(request))
+
+
+class KeychainServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answer KeychainClient requests for an unlocked keychain
+
+    The socket is created readable and writable by the owner only.
+    """
+    daemon_threads = True
+
+    def __init__(self, keychain, socket_path):
+        self.keychain = keychain
+        self.socket_path = socket_path
+        try:
+            mode = os.lstat(socket_path).st_mode
+        except OSError:
+            pass
+        else:
+            # a stale socket from an earlier run; anything else is left alone
+            if not stat.S_ISSOCK(mode):
+                raise KeychainServerError("%s exists and is not a socket" % socket_path)
+            os.unlink(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, _Handler)
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        # before listen(), so nobody can connect while it has the default mode
+        os.chmod(self.socket_path, 0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def _lookup(self, uuid):
+        try:
+            return self.keychain.get_by_uuid(uuid)
+        except KeyError:
+            raise _NotFound(uuid)
+
+    def dispatch(self, request):
+        keychain = self.keychain
+        try:
+            op, argument = six.indexbytes(request, 0), request[1:].decode('utf-8')
+            if op == OP_LIST:
+                body = [_summary(item) for item in keychain._all_items()]
+            elif op == OP_GET:
+                body = _summary(self._lookup(argument))
+            elif op == OP_DECRYPT:
+                body = self._lookup(argument).decrypt()
+            elif op == OP_SEARCH:
+                body = [_summary(item) for item in keychain.search(argument)]
+            elif op == OP_FIND_BY_DOMAIN:
+                body = [_summary(item) for item in keychain.find_by_domain(argument)]
+            elif op == OP_REFRESH:
+                body = keychain.refresh()
+            else:
+                raise KeychainServerError("Unknown opcode %d" % op)
+        except _NotFound as e:
+            return struct.pack('B', STATUS_NOT_FOUND) + e.args[0].encode('utf-8')
+        except Exception as e:
+            return struct.pack('B', STATUS_ERROR) + ('%s: %s' % (e.__class__.__name__, e)).encode('utf-8')
+        return struct.pack('B', STATUS_OK) + simplejson.dumps(body).encode('utf-8')
+
+
+class KeychainClient(object):
+    """Talk to a KeychainServer, keeping up to pool_size connections open
+
+    Safe to share between threads. A client inherited across a fork opens
+    fresh connections in the child.
+    """
+
+    def __init__(self, socket_path, pool_size=4, timeout=None):
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._pool = queue.LifoQueue()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # the parent's connections would interleave with ours
+                self._reset()
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, sock):
+        if self._pid == os.getpid() and self._pool.qsize() < self.pool_size:
+            self._pool.put(sock)
+        else:
+            sock.close()
+
+    def _call(self, op, argument=u''):
+        sock = self._acquire()
+        try:
+            send_message(sock, struct.pack('B', op) + argument.encode('utf-8'))
+            response = recv_message(sock)
+        except Exception:
+            sock.close()
+            raise
+        if response is None:
+            sock.close()
+            raise KeychainServerError("Server closed the connection")
+        self._release(sock)
+        status, body = six.indexbytes(response, 0), response[1:]
+        if status == STATUS_NOT_FOUND:
+            raise KeyError(body.decode('utf-8'))
+        if status != STATUS_OK:
+            raise KeychainServerError(body.decode('utf-8'))
+        return simplejson.loads(body.decode('utf-8'))
+
+    def list(self):
+        """Summaries (uuid, title, category, updated, urls, tags) of every item"""
+        return self._call(OP_LIST)
+
+    def get(self, uuid):
+        return self._call(OP_GET, uuid)
+
+    def decrypt(self, uuid):
+        return self._call(OP_DECRYPT, uuid)
+
+    def search(self, query):
+        return self._call(OP_SEARCH, query)
+
+    def find_by_domain(self, url):
+        return self._call(OP_FIND_BY_DOMAIN, url)
+
+    def refresh(self):
+        """Have the server pick up changes on disk; returns (added, updated, removed)"""
+        return tuple(self._call(OP_REFRESH))
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def main():
+    from .keychain import AKeychain, CKeychain
+
+    parser = argparse.ArgumentParser(description='Serve an unlocked 1Password keychain over a Unix socket')
+    parser.add_argument('--socket', required=True, help='path of the socket to listen on')
+    parser.add_argument('path', help='.agilekeychain or .cloudkeychain to unlock')
+    args = parser.parse_args()
+
+    keychain_class = CKeychain if args.path.rstrip('/').endswith('.cloudkeychain') else AKeychain
+    keychain = keychain_class(args.path)
+    keychain.unlock(getpass.getpass('Password for %s: ' % args.path))
+    server = KeychainServer(keychain, args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Frozen, fork-friendly snapshot of a .cloudkeychain's items
+
+A Snapshot packs the uuid, category code, updated timestamp and encrypted
+overview, key and data of every item into one anonymous shared mmap, which
+is never written to after it is built. Processes forked after freezing read
+it through struct lookups and slices, so there is no per-item Python object
+whose reference count would dirty (and copy) the shared pages; a CItem is
+only created, in the process asking, when a row is used.
+
+    keychain.unlock(password)
+    keychain.freeze()
+    gc.freeze()  # Python 3.7+: keep the collector off the parent's objects
+    os.fork()
+
+Layout (little-endian): magic, item count, then the uuids (sorted), the
+category codes, the updated timestamps and the segment offsets as fixed-width
+columns, followed by the arena of encrypted blobs.
+"""
+import mmap
+import struct
+
+from .store import UUID_LENGTH, ItemStore, _SEGMENTS
+
+MAGIC = b'OPSNAP01'
+_HEADER = struct.Struct('<8sQ')
+_CATEGORY = struct.Struct('<H')
+_UPDATED = struct.Struct('<d')
+_OFFSET = struct.Struct('<Q')
+
+
+class _Column(object):
+    """Read-only sequence of fixed-width values in a buffer"""
+    __slots__ = ('_buffer', '_start', '_struct', '_length')
+
+    def __init__(self, buffer, start, fmt, length):
+        self._buffer = buffer
+        self._start = start
+        self._struct = fmt
+        self._length = length
+
+    @property
+    def end(self):
+        return self._start + self._length * self._struct.size
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        return self._struct.unpack_from(self._buffer, self._start + index * self._struct.size)[0]
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield self[index]
+
+
+class Snapshot(ItemStore):
+    """An ItemStore whose columns and arena live in one shared mmap
+
+    Rows are in uuid order, so looking up a uuid bisects the uuid column
+    rather than building a dict.
+    """
+
+    def __init__(self, keychain, buffer):
+        super(Snapshot, self).__init__(keychain)
+        magic, count = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a keychain snapshot")
+        self._buffer = buffer
+        self._uuid_start = _HEADER.size
+        self._category_codes = _Column(buffer, self._uuid_start + count * UUID_LENGTH, _CATEGORY, count)
+        self._updated = _Column(buffer, self._category_codes.end, _UPDATED, count)
+        self._offsets = _Column(buffer, self._updated.end, _OFFSET, count * _SEGMENTS + 1)
+        self._arena_start = self._offsets.end
+        self._uuids = self._arena = None
+
+    @classmethod
+    def freeze(cls, keychain, items):
+        """Pack CItems built from band blobs into a new snapshot (items
+        loaded from an overview index don't carry their blobs)"""
+        def rows():
+            for item in items:
+                # None if the blob had no item key and data (e.g. a tombstone)
+                key, data = item._encrypted_data or (None, None)
+                yield item.uuid, int(item.category_code), item.updated, item.encrypted_overview, key, data
+        return cls._pack(keychain, rows())
+
+    @classmethod
+    def from_store(cls, store):
+        """Pack the rows of an ItemStore into a new snapshot"""
+        return cls._pack(store.keychain, (
+            (store.uuid(row), int(store.category_code(row)), store.updated(row))
+            + tuple(store._segment(row, segment) for segment in range(_SEGMENTS))
+            for row in range(len(store))
+        ))
+
+    @classmethod
+    def _pack(cls, keychain, rows):
+        rows = sorted(rows, key=lambda row: row[0])
+        uuids, segments, offsets = [], [], [0]
+        for row in rows:
+            uuid = row[0].encode('ascii')
+            if len(uuid) != UUID_LENGTH:
+                raise ValueError("Unexpected uuid %r" % row[0])
+            uuids.append(uuid)
+            for segment in row[3:]:
+                segments.append(segment or b'')
+                offsets.append(offsets[-1] + len(segments[-1]))
+        count = len(rows)
+        parts = [
+            _HEADER.pack(MAGIC, count),
+            b''.join(uuids),
+            struct.pack('<%dH' % count, *(row[1] for row in rows)),
+            struct.pack('<%dd' % count, *(row[2] for row in rows)),
+            struct.pack('<%dQ' % len(offsets), *offsets),
+        ]
+        size = sum(len(part) for part in parts) + offsets[-1]
+        # anonymous maps are MAP_SHARED, so children see the parent's pages
+        buffer = mmap.mmap(-1, max(size, 1))
+        for part in parts + segments:
+            buffer.write(part)
+        return cls(keychain, buffer)
+
+    def __len__(self):
+        return len(self._category_codes)
+
+    def uuid(self, row):
+        start = self._uuid_start + row * UUID_LENGTH
+        return self._buffer[start:start + UUID_LENGTH].decode('ascii')
+
+    def _segment(self, row, segment):
+        index = row * _SEGMENTS + segment
+        start, end = self._offsets[index], self._offsets[index + 1]
+        if end <= start:
+            return None
+        return self._buffer[self._arena_start + start:self._arena_start + end]
+
+    def row(self, uuid):
+        try:
+            key = uuid.encode('ascii')
+        except UnicodeError:
+            raise KeyError(uuid)
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            start = self._uuid_start + middle * UUID_LENGTH
+            found = self._buffer[start:start + UUID_LENGTH]
+            if found == key:
+                return middle
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        raise KeyError(uuid)
+
+    def rows(self, category_code=None, since=None, until=None, order_by=None, reverse=False):
+        # rows are already in uuid order
+        if order_by == 'uuid':
+            order_by = None
+        return super(Snapshot, self).rows(category_code, since, until, order_by, reverse)
@@ -0,0 +1,167 @@
+"""Columnar in-memory storage of a .cloudkeychain's items
+
+An ItemStore keeps one row per item in parallel arrays (uuid, category code
+and updated timestamp) and the encrypted overview, key and data of every
+item back to back in a single bytes arena. Listing, filtering by category
+and selecting by updated time work on those arrays; a CItem is only created
+for a row when it is asked for.
+
+    store = ItemStore.from_blobs(keychain, blobs)
+    rows = store.rows(category_code='001', since=timestamp, order_by='updated')
+    items = store.items(rows)
+"""
+import array
+import base64
+import bisect
+
+from .item import CItem
+
+UUID_LENGTH = 32
+# overview, item key and item data
+_SEGMENTS = 3
+
+
+class ItemStore(object):
+    def __init__(self, keychain):
+        self.keychain = keychain
+        self._uuids = b''
+        self._category_codes = array.array('H')
+        # 'd' rather than 'q', which python 2's array lacks
+        self._updated = array.array('d')
+        self._offsets = array.array('L', [0])
+        self._arena = b''
+        self._materialized = {}
+        self._rows_by_uuid = None
+        self._rows_by_category = None
+        self._by_updated = None
+        self._sorted_updated = None
+
+    @classmethod
+    def from_blobs(cls, keychain, blobs):
+        """Build a store from verified band blobs (as yielded by a band
+        reader); the blobs themselves aren't kept"""
+        store = cls(keychain)
+        uuids, segments = [], []
+        offset = 0
+        for blob in blobs:
+            uuid = blob['uuid'].encode('ascii')
+            if len(uuid) != UUID_LENGTH:
+                raise ValueError("Unexpected uuid %r" % blob['uuid'])
+            uuids.append(uuid)
+            store._category_codes.append(int(blob['category']))
+            store._updated.append(blob['updated'])
+            for key in ('o', 'k', 'd'):
+                segment = base64.b64decode(blob[key]) if key in blob else b''
+                segments.append(segment)
+                offset += len(segment)
+                store._offsets.append(offset)
+        store._uuids = b''.join(uuids)
+        store._arena = b''.join(segments)
+        return store
+
+    def __len__(self):
+        return len(self._category_codes)
+
+    def uuid(self, row):
+        return self._uuids[row * UUID_LENGTH:(row + 1) * UUID_LENGTH].decode('ascii')
+
+    def category_code(self, row):
+        return '%03d' % self._category_codes[row]
+
+    def updated(self, row):
+        return int(self._updated[row])
+
+    def _segment(self, row, segment):
+        index = row * _SEGMENTS + segment
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return self._arena[start:end] if end > start else None
+
+    def row(self, uuid):
+        """The row of the item with this uuid; raises KeyError"""
+        if self._rows_by_uuid is None:
+            self._rows_by_uuid = dict((self.uuid(row), row) for row in range(len(self)))
+        return self._rows_by_uuid[uuid]
+
+    def _category_rows(self, code):
+        if self._rows_by_category is None:
+            rows_by_category = {}
+            for row, category in enumerate(self._category_codes):
+                rows_by_category.setdefault(category, array.array('L')).append(row)
+            self._rows_by_category = rows_by_category
+        return self._rows_by_category.get(code, array.array('L'))
+
+    def _updated_order(self):
+        if self._by_updated is None:
+            by_updated = sorted(range(len(self)), key=self._updated.__getitem__)
+            self._by_updated = array.array('L', by_updated)
+            self._sorted_updated = array.array('d', (self._updated[row] for row in by_updated))
+        return self._by_updated, self._sorted_updated
+
+    def rows(self, category_code=None, since=None, until=None, order_by=None, reverse=False):
+        """Rows matching every given criterion
+
+        Arguments:
+            category_code - only items in this category (e.g. '001')
+            since, until - only items updated at or after / before these
+                timestamps
+            order_by - 'updated' or 'uuid'; rows are in load order otherwise
+            reverse - reverse the order
+        """
+        if since is not None or until is not None:
+            by_updated, sorted_updated = self._updated_order()
+            start = 0 if since is None else bisect.bisect_left(sorted_updated, since)
+            end = len(self) if until is None else bisect.bisect_left(sorted_updated, until)
+            rows = by_updated[start:end]
+            if category_code is not None:
+                code = int(category_code)
+                categories = self._category_codes
+                rows = array.array('L', (row for row in rows if categories[row] == code))
+            if order_by is None:
+                rows = array.array('L', sorted(rows))
+        elif category_code is not None:
+            rows = array.array('L', self._category_rows(int(category_code)))
+        else:
+            rows = array.array('L', range(len(self)))
+        if order_by == 'updated':
+            if since is None and until is None:
+                rows = array.array('L', sorted(rows, key=self._updated.__getitem__))
+        elif order_by == 'uuid':
+            rows = array.array('L', sorted(rows, key=self.uuid))
+        elif order_by is not None:
+            raise ValueError("Can't order by %r" % order_by)
+        if reverse:
+            rows = rows[::-1]
+        return rows
+
+    def count(self, **criteria):
+        return len(self.rows(**criteria))
+
+    def item(self, row):
+        """The CItem for a row, created on first use"""
+        item = self._materialized.get(row)
+        if item is None:
+            item = CItem.new_from_encrypted(
+                self.keychain,
+                self.uuid(row),
+                self.category_code(row),
+                self.updated(row),
+                self._segment(row, 0),
+                self._segment(row, 1),
+                self._segment(row, 2),
+            )
+            self._materialized[row] = item
+        return item
+
+    def items(self, rows=None):
+        """Yield the CItems for rows (default: every row)"""
+        if rows is None:
+            rows = range(len(self))
+        for row in rows:
+            yield self.item(row)
+
+    def get_by_uuid(self, uuid):
+        return self.item(self.row(uuid))
+
+    def updated_by_uuid(self):
+        """Map every uuid to its updated timestamp"""
+        return dict((self.uuid(row), self.updated(row)) for row in range(len(self)))
@@ -9,3 +9,29 @@ def make_utf8(*args):
         return rv[0]
     else:
         return rv
+
+
+def cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def parallel_map(fn, iterable, max_workers=None):
+    """Like map(), but spread over a thread pool. Results come back in input
+    order. Falls back to a serial map if concurrent.futures is unavailable
+    or only one worker is wanted."""
+    items = list(iterable)
+    if max_workers is None:
+        max_workers = cpu_count()
+    max_workers = min(max_workers, len(items))
+    if max_workers <= 1:
+        return [fn(item) for item in items]
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fn, items))
@@ -0,0 +1,243 @@
+"""Keep an unlocked keychain in sync with its files on disk.
+
+KeychainWatcher watches a keychain's data directory (with inotify on Linux,
+by polling elsewhere) and applies incremental refresh()es on a background
+thread. Readers keep using the keychain's items and indexes while that
+happens. If the key file (profile.js / encryptionKeys.js) changes, the
+keychain is locked instead, and on_unlock_required is called so the owner
+can unlock it again with the password (see KeychainWatcher.unlock).
+"""
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    name = ctypes.util.find_library('c')
+    if name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+_libc = _load_libc()
+
+
+class _Inotify(object):
+    def __init__(self, path):
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if _libc.inotify_add_watch(self.fd, path.encode('utf-8'), _WATCH_MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, 'inotify_add_watch failed for %s' % path)
+
+    def read(self, timeout):
+        """Wait up to timeout seconds; return the set of changed file names.
+        None in the set means events were lost."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return set()
+            raise
+        names = set()
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            if mask & IN_Q_OVERFLOW:
+                names.add(None)
+            elif length:
+                names.add(data[offset:offset + length].rstrip(b'\x00').decode('utf-8', 'replace'))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poller(object):
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.state = self._snapshot()
+
+    def _snapshot(self):
+        state = {}
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return state
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            state[name] = (st.st_mtime, st.st_size)
+        return state
+
+    def read(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        state = self._snapshot()
+        names = set(name for name in set(state) | set(self.state) if state.get(name) != self.state.get(name))
+        self.state = state
+        return names
+
+    def close(self):
+        pass
+
+
+def _digest(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).digest()
+    except (IOError, OSError):
+        return None
+
+
+class KeychainWatcher(object):
+    """Apply on-disk changes to an unlocked keychain as they happen
+
+    Arguments:
+        keychain - an unlocked AKeychain or CKeychain
+        on_change - called with (added, updated, removed) uuids after each
+            refresh that changed something
+        on_unlock_required - called with the keychain after a key file change
+            has locked it
+        debounce - seconds of quiet to wait for after a change before
+            refreshing, so that a burst of sync writes is applied once
+        poll_interval - how often to rescan when inotify isn't available
+        use_inotify - set to False to force polling
+    """
+
+    def __init__(self, keychain, on_change=None, on_unlock_required=None, debounce=0.5, poll_interval=2.0,
+                 use_inotify=True):
+        self.keychain = keychain
+        self.on_change = on_change
+        self.on_unlock_required = on_unlock_required
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and _libc is not None
+        self.directory = os.path.join(keychain.base_path, *keychain.DATA_DIR)
+        self.key_files = dict((name, _digest(os.path.join(self.directory, name))) for name in keychain.KEY_FILES)
+        self.unlock_required = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        if self.use_inotify:
+            self._source = _Inotify(self.directory)
+        else:
+            self._source = _Poller(self.directory, self.poll_interval)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='KeychainWatcher(%s)' % self.keychain.base_path)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._source.close()
+
+    def unlock(self, password):
+        """Unlock the keychain again after a key change and resume syncing"""
+        self.keychain.unlock(password)
+        self.unlock_required = False
+
+    def _relevant(self, name):
+        return name is None or name in self.key_files or name.endswith('.js') or name.endswith('.1password')
+
+    def _wait_for_changes(self):
+        """Block until something relevant changed and then settled down"""
+        pending = set()
+        while not self._stop.is_set():
+            names = set(n for n in self._source.read(self.poll_interval) if self._relevant(n))
+            if names:
+                pending |= names
+                deadline = time.time() + self.debounce
+                while not self._stop.is_set() and time.time() < deadline:
+                    more = set(n for n in self._source.read(max(deadline - time.time(), 0)) if self._relevant(n))
+                    if more:
+                        pending |= more
+                        deadline = time.time() + self.debounce
+                return pending
+        return pending
+
+    def _keys_changed(self):
+        changed = False
+        for name, digest in self.key_files.items():
+            current = _digest(os.path.join(self.directory, name))
+            if current != digest:
+                self.key_files[name] = current
+                changed = True
+        return changed
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._wait_for_changes():
+                continue
+            try:
+                self.apply_changes()
+            except Exception:
+                # most likely a half-synced file; the rest of the write will
+                # come along as another event and we'll try again then
+                log.exception("Failed to refresh %s", self.keychain.base_path)
+
+    def apply_changes(self):
+        """Check the key files and refresh the keychain; also what the
+        background thread runs after each burst of changes"""
+        if self._keys_changed():
+            log.info("Keys changed for %s; locking", self.keychain.base_path)
+            self.unlock_required = True
+            self.keychain.lock()
+            if self.on_unlock_required is not None:
+                self.on_unlock_required(self.keychain)
+            return
+        if self.unlock_required:
+            return
+        changes = self.keychain.refresh()
+        if any(changes) and self.on_change is not None:
+            self.on_change(*changes)
@@ -25,7 +25,6 @@ setup(
     description='Python tools for reading 1Password data files',
     classifiers=[
         "Programming Language :: Python",
-        'Programming Language :: Python :: 2.6',
         'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3.3',
         "Operating System :: OS Independent",
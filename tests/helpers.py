@@ -1,3 +1,7 @@
+import base64
+import os.path
+import shutil
+import tempfile
 from contextlib import contextmanager
 
 
@@ -9,3 +13,37 @@ def assert_raises(exc_klass):
     except Exception as exc:
         excepted = exc
     assert type(excepted) == exc_klass
+
+
+def temp_dir(testcase):
+    """A new temporary directory, removed once testcase has finished"""
+    path = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, path)
+    return path
+
+
+def copy_vault(testcase, source):
+    """A copy of the vault at source, in a temp_dir()"""
+    root = os.path.join(temp_dir(testcase), os.path.basename(source))
+    shutil.copytree(source, root)
+    return root
+
+
+def b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def sample_blobs():
+    """Band blobs for five items (with made-up, unencrypted overviews, keys
+    and data) followed by a tombstone without key or data"""
+    blobs = [
+        {'uuid': '%032X' % i, 'category': category, 'updated': updated,
+         'o': b64(('overview %d' % i).encode('ascii')),
+         'k': b64(('key %d' % i).encode('ascii')),
+         'd': b64(('data %d' % i).encode('ascii'))}
+        for i, (category, updated) in enumerate([
+            ('001', 300), ('002', 100), ('001', 200), ('003', 400), ('001', 100),
+        ])
+    ]
+    blobs.append({'uuid': '%032X' % 5, 'category': '099', 'updated': 50})
+    return blobs
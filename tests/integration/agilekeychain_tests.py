@@ -1,8 +1,13 @@
 import os.path
+import shutil
 
+import mock
+import simplejson
 from unittest2 import TestCase
 
 import onepassword.keychain
+from onepassword.cache import ItemCache, KeyCache
+from ..helpers import copy_vault, temp_dir
 
 
 class AgileKeychainIntegrationTestCase(TestCase):
@@ -19,3 +24,151 @@ class AgileKeychainIntegrationTestCase(TestCase):
         google = c.get_by_uuid('00925AACC28B482ABFE650FCD42F82CD')
         self.assertEqual(google.title, 'Google')
         self.assertEqual(google.decrypt()['fields'][1]['value'], 'test_password')
+
+    def test_indexes(self):
+        c = onepassword.keychain.AKeychain(self.test_file_root)
+        with self.assertRaises(KeyError):
+            c.get_by_uuid('00925AACC28B482ABFE650FCD42F82CD')
+        c.unlock("george")
+        self.assertEqual([i.uuid for i in c.get_by_title('Some note')], ['8D2123CA524D4AB5B81E5434546D226B'])
+        self.assertEqual(len(c.get_by_category('webforms.WebForm')), 1)
+
+    def test_lazy_open(self):
+        c = onepassword.keychain.AKeychain(self.test_file_root, lazy=True)
+        c.unlock("george")
+        self.assertEqual(len(c.items), 2)
+        google = c.get_by_uuid('00925AACC28B482ABFE650FCD42F82CD')
+        self.assertEqual(google.title, 'Google')
+        self.assertEqual(google.category, 'webforms.WebForm')
+        self.assertFalse(google.loaded)
+        self.assertEqual(google.decrypt()['fields'][1]['value'], 'test_password')
+        self.assertTrue(google.loaded)
+        self.assertFalse(c.get_by_uuid('8D2123CA524D4AB5B81E5434546D226B').loaded)
+
+    def test_search(self):
+        c = onepassword.keychain.AKeychain(self.test_file_root, lazy=True)
+        c.unlock("george")
+        self.assertEqual([i.title for i in c.search('goo')], ['Google'])
+        self.assertEqual([i.title for i in c.search('note')], ['Some note'])
+        self.assertEqual([i.title for i in c.find_by_domain('https://mail.google.com/')], ['Google'])
+        self.assertFalse(c.get_by_uuid('00925AACC28B482ABFE650FCD42F82CD').loaded)
+
+    def test_compact_items(self):
+        c = onepassword.keychain.AKeychain(self.test_file_root)
+        c.unlock("george")
+        google = c.get_by_uuid('00925AACC28B482ABFE650FCD42F82CD')
+        self.assertFalse(hasattr(google, '__dict__'))
+        self.assertTrue(google.encrypted.startswith(b'Salted__'))
+        self.assertEqual(google.data['uuid'], google.uuid)
+        self.assertIs(google.data, google.data)
+        # the public decrypt() still takes the base64 text from the item file
+        self.assertEqual(
+            simplejson.loads(c.decrypt(google.key_identifier, google.data['encrypted']))['fields'][1]['value'],
+            'test_password',
+        )
+
+    def test_key_cache(self):
+        key_cache = KeyCache()
+        c = onepassword.keychain.AKeychain(self.test_file_root, key_cache=key_cache)
+        c.unlock("george")
+        with mock.patch.object(onepassword.crypt_util, 'a_decrypt_key') as decrypt_key:
+            d = onepassword.keychain.AKeychain(self.test_file_root, key_cache=key_cache)
+            d.unlock("george")
+            self.assertEqual(decrypt_key.call_count, 0)
+        self.assertEqual(d.keys, c.keys)
+
+    def test_item_cache(self):
+        item_cache = ItemCache()
+        c = onepassword.keychain.AKeychain(self.test_file_root, item_cache=item_cache)
+        c.unlock("george")
+        google = c.get_by_uuid('00925AACC28B482ABFE650FCD42F82CD')
+        google.decrypt()
+        with mock.patch.object(c, '_decrypt_raw') as decrypt:
+            self.assertEqual(google.decrypt()['fields'][1]['value'], 'test_password')
+            self.assertEqual(decrypt.call_count, 0)
+        c.lock()
+        self.assertEqual(len(item_cache), 0)
+        self.assertEqual(c.keys, {})
+
+    def test_decrypt_all(self):
+        c = onepassword.keychain.AKeychain(self.test_file_root, lazy=True)
+        c.unlock("george")
+        results = list(c.decrypt_all())
+        self.assertEqual([item for item, _ in results], c.items)
+        self.assertEqual(dict((item.uuid, data) for item, data in results)[
+            '00925AACC28B482ABFE650FCD42F82CD']['fields'][1]['value'], 'test_password')
+
+
+class AgileKeychainRefreshTestCase(TestCase):
+    google_uuid = '00925AACC28B482ABFE650FCD42F82CD'
+    note_uuid = '8D2123CA524D4AB5B81E5434546D226B'
+
+    def setUp(self):
+        self.root = copy_vault(self, AgileKeychainIntegrationTestCase.test_file_root)
+
+    def path(self, name):
+        return os.path.join(self.root, 'data', 'default', name)
+
+    def rewrite(self, name, fn):
+        with open(self.path(name)) as f:
+            data = simplejson.load(f)
+        data = fn(data)
+        with open(self.path(name), 'w') as f:
+            simplejson.dump(data, f)
+        st = os.stat(self.path(name))
+        os.utime(self.path(name), (st.st_atime, st.st_mtime + 10))
+
+    def unlocked(self, lazy):
+        c = onepassword.keychain.AKeychain(self.root, lazy=lazy)
+        c.unlock("george")
+        return c
+
+    def test_noop(self):
+        for lazy in (False, True):
+            c = self.unlocked(lazy)
+            self.assertEqual(c.refresh(), ([], [], []))
+
+    def test_keeps_keys(self):
+        c = self.unlocked(False)
+        with mock.patch.object(onepassword.crypt_util, 'a_decrypt_key') as decrypt_key:
+            self.rewrite('%s.1password' % self.note_uuid, lambda d: dict(d, title='Renamed'))
+            self.assertEqual(c.refresh(), ([], [self.note_uuid], []))
+            self.assertEqual(decrypt_key.call_count, 0)
+        self.assertEqual(c.get_by_uuid(self.note_uuid).title, 'Renamed')
+        self.assertEqual(c.get_by_title('Renamed'), [c.get_by_uuid(self.note_uuid)])
+        self.assertEqual(c.get_by_uuid(self.google_uuid).decrypt()['fields'][1]['value'], 'test_password')
+
+    def test_lazy_contents_timestamps(self):
+        c = self.unlocked(True)
+        google = c.get_by_uuid(self.google_uuid)
+
+        def bump(contents):
+            for entry in contents:
+                if entry[0] == self.note_uuid:
+                    entry[2] = 'Renamed'
+                    entry[4] += 1
+            return contents
+        self.rewrite('contents.js', bump)
+        self.assertEqual(c.refresh(), ([], [self.note_uuid], []))
+        self.assertEqual(c.get_by_uuid(self.note_uuid).title, 'Renamed')
+        self.assertIs(c.get_by_uuid(self.google_uuid), google)
+
+        self.rewrite('contents.js', lambda contents: [e for e in contents if e[0] != self.note_uuid])
+        self.assertEqual(c.refresh(), ([], [], [self.note_uuid]))
+        self.assertEqual(c.get_by_title('Renamed'), [])
+
+    def test_loaded_item_file_changed(self):
+        c = self.unlocked(True)
+        c.get_by_uuid(self.google_uuid).decrypt()
+        self.rewrite('%s.1password' % self.google_uuid, lambda d: dict(d, title='Google 2'))
+        self.assertEqual(c.refresh(), ([], [self.google_uuid], []))
+
+    def test_files_added_and_removed(self):
+        c = self.unlocked(False)
+        aside = temp_dir(self)
+        shutil.move(self.path('%s.1password' % self.note_uuid), aside)
+        self.assertEqual(c.refresh(), ([], [], [self.note_uuid]))
+        self.assertEqual(len(c.items), 1)
+        shutil.move(os.path.join(aside, '%s.1password' % self.note_uuid), self.path(''))
+        self.assertEqual(c.refresh(), ([self.note_uuid], [], []))
+        self.assertEqual(len(c.items), 2)
@@ -0,0 +1,38 @@
+import sys
+
+from unittest2 import TestCase, skipIf
+
+from . import agilekeychain_tests
+from . import cloudkeychain_tests
+
+
+def run(coro):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@skipIf(sys.version_info < (3, 5), 'asyncio API needs Python 3.5+')
+class AsyncKeychainTestCase(TestCase):
+    def test_cloudkeychain(self):
+        from onepassword.aio import AsyncCKeychain
+        c = run(AsyncCKeychain.open(cloudkeychain_tests.CloudKeychainIntegrationTestCase.test_file_root))
+        run(c.unlock("fred"))
+        skype_item = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        self.assertEqual(run(c.overview(skype_item))['title'], 'Skype')
+        self.assertEqual(run(c.decrypt('2A632FDD32F5445E91EB5636C7580447'))['fields'][1]['value'],
+                         'dej3ur9unsh5ian1and5')
+        results = run(c.decrypt_many(c.items))
+        self.assertEqual(len(results), len(c.items))
+        self.assertEqual(results[c.items.index(skype_item)], run(c.decrypt(skype_item)))
+
+    def test_agilekeychain_lazy(self):
+        from onepassword.aio import AsyncAKeychain
+        c = run(AsyncAKeychain.open(agilekeychain_tests.AgileKeychainIntegrationTestCase.test_file_root, lazy=True))
+        run(c.unlock("george"))
+        google = run(c.load('00925AACC28B482ABFE650FCD42F82CD'))
+        self.assertTrue(google.loaded)
+        self.assertEqual(run(c.decrypt(google))['fields'][1]['value'], 'test_password')
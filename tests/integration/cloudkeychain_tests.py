@@ -1,8 +1,17 @@
+import base64
+import datetime
 import os.path
+import sys
 
+import mock
+import simplejson
 from unittest2 import TestCase
 
 import onepassword.keychain
+from onepassword import crypt_util
+from onepassword.cache import ItemCache, KeyCache
+from onepassword.snapshot import Snapshot
+from ..helpers import copy_vault, temp_dir
 
 
 class CloudKeychainIntegrationTestCase(TestCase):
@@ -18,3 +27,347 @@ class CloudKeychainIntegrationTestCase(TestCase):
         skype_item = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
         self.assertEqual(skype_item.title, 'Skype')
         self.assertEqual(skype_item.decrypt()['fields'][1]['value'], 'dej3ur9unsh5ian1and5')
+
+    def test_indexes(self):
+        c = onepassword.keychain.CKeychain(self.test_file_root)
+        c.unlock("fred")
+        self.assertEqual(len(c.items_by_uuid), len(c.items))
+        self.assertEqual([i.uuid for i in c.get_by_title('Skype')], ['2A632FDD32F5445E91EB5636C7580447'])
+        self.assertEqual(len(c.get_by_category('Credit Card')), 2)
+        self.assertEqual(c.get_by_title('nonexistent'), [])
+        with self.assertRaises(KeyError):
+            c.get_by_uuid('nonexistent')
+
+    def test_indexes_rebuilt_on_reload(self):
+        c = onepassword.keychain.CKeychain(self.test_file_root)
+        c.unlock("fred")
+        skype_item = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        c.unlock("fred")
+        self.assertIsNot(c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447'), skype_item)
+        self.assertEqual(sum(len(v) for v in c.items_by_category.values()), len(c.items))
+
+    def test_lazy_overview(self):
+        c = onepassword.keychain.CKeychain(self.test_file_root)
+        c.unlock("fred")
+        self.assertTrue(all(i._overview is None for i in c.items))
+        self.assertEqual(len(c.get_by_category('Login')), 9)
+        self.assertTrue(all(i._overview is None for i in c.items))
+        skype_item = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        self.assertEqual(skype_item.title, 'Skype')
+        self.assertIs(skype_item.overview, skype_item.overview)
+
+    def test_compact_items(self):
+        c = onepassword.keychain.CKeychain(self.test_file_root)
+        c.unlock("fred")
+        skype_item = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        self.assertFalse(hasattr(skype_item, '__dict__'))
+        self.assertTrue(skype_item.encrypted_overview.startswith(b'opdata01'))
+        self.assertTrue(skype_item.encrypted_data[1].startswith(b'opdata01'))
+        self.assertEqual(skype_item.updated_at, datetime.datetime.fromtimestamp(skype_item.updated))
+        # the public decrypt_* methods still take base64 text, as in band files
+        key_blob, data_blob = (base64.b64encode(blob) for blob in skype_item.encrypted_data)
+        self.assertEqual(simplejson.loads(c.decrypt_data(key_blob, data_blob)), skype_item.decrypt())
+        self.assertEqual(
+            simplejson.loads(c.decrypt_overview(base64.b64encode(skype_item.encrypted_overview)))['title'], 'Skype')
+
+    def test_columnar(self):
+        c = onepassword.keychain.CKeychain(self.test_file_root, columnar=True)
+        c.unlock("fred")
+        self.assertEqual(c.items, [])
+        self.assertEqual(c.store._materialized, {})
+        skype_item = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        self.assertEqual(skype_item.title, 'Skype')
+        self.assertEqual(skype_item.decrypt()['fields'][1]['value'], 'dej3ur9unsh5ian1and5')
+        self.assertEqual(len(c.get_by_category('Credit Card')), 2)
+        self.assertEqual(len(c.store._materialized), 3)
+        self.assertEqual([i.uuid for i in c.get_by_title('Skype')], ['2A632FDD32F5445E91EB5636C7580447'])
+        self.assertEqual(len(list(c.decrypt_all(max_workers=1))), len(c.store))
+        full = onepassword.keychain.CKeychain(self.test_file_root)
+        full.unlock("fred")
+        self.assertEqual(
+            sorted(c.store.uuid(row) for row in c.store.rows(category_code='001')),
+            sorted(i.uuid for i in full.get_by_category('Login')),
+        )
+
+    def test_freeze(self):
+        c = onepassword.keychain.CKeychain(self.test_file_root)
+        c.unlock("fred")
+        uuids = sorted(i.uuid for i in c.items)
+        c.freeze()
+        self.assertEqual((c.items, c.items_by_uuid), ([], {}))
+        self.assertEqual([c.store.uuid(row) for row in range(len(c.store))], uuids)
+        self.assertEqual(len(c.get_by_category('Credit Card')), 2)
+        self.assertEqual([i.title for i in c.search('sky')], ['Skype'])
+        if not hasattr(os, 'fork'):
+            return
+        pid = os.fork()
+        if pid == 0:
+            try:
+                data = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447').decrypt()
+                ok = data['fields'][1]['value'] == 'dej3ur9unsh5ian1and5'
+            except Exception:
+                ok = False
+            os._exit(0 if ok else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        c.lock()
+        self.assertEqual((c.store, c.frozen), (None, False))
+
+    def test_search(self):
+        for columnar in (False, True):
+            c = onepassword.keychain.CKeychain(self.test_file_root, columnar=columnar)
+            c.unlock("fred")
+            self.assertEqual([i.title for i in c.search('sky')], ['Skype'])
+            # account names (ainfo) aren't indexed
+            self.assertEqual(c.search('wendy'), [])
+            self.assertEqual([i.title for i in c.find_by_domain('https://login.hulu.com/')], ['Hulu'])
+
+    def test_executor_matches_serial(self):
+        from concurrent.futures import ThreadPoolExecutor
+        serial = onepassword.keychain.CKeychain(self.test_file_root)
+        serial.unlock("fred")
+        executor = ThreadPoolExecutor(max_workers=4)
+        try:
+            parallel = onepassword.keychain.CKeychain(self.test_file_root, executor=executor)
+            parallel.unlock("fred")
+        finally:
+            executor.shutdown()
+        self.assertEqual([i.uuid for i in parallel.items], [i.uuid for i in serial.items])
+        self.assertEqual(
+            dict((k, [i.uuid for i in v]) for k, v in parallel.items_by_category.items()),
+            dict((k, [i.uuid for i in v]) for k, v in serial.items_by_category.items()),
+        )
+        self.assertEqual(parallel.get_by_uuid('2A632FDD32F5445E91EB5636C7580447').title, 'Skype')
+
+    def test_key_cache(self):
+        key_cache = KeyCache()
+        c = onepassword.keychain.CKeychain(self.test_file_root, key_cache=key_cache)
+        c.unlock("fred")
+        with mock.patch.object(onepassword.crypt_util, 'opdata1_derive_keys') as derive:
+            d = onepassword.keychain.CKeychain(self.test_file_root, key_cache=key_cache)
+            d.unlock("fred")
+            self.assertEqual(derive.call_count, 0)
+        self.assertEqual(d.get_by_uuid('2A632FDD32F5445E91EB5636C7580447').title, 'Skype')
+        with self.assertRaises(ValueError):
+            onepassword.keychain.CKeychain(self.test_file_root, key_cache=key_cache).unlock("george")
+
+    def test_item_cache(self):
+        item_cache = ItemCache()
+        c = onepassword.keychain.CKeychain(self.test_file_root, item_cache=item_cache)
+        c.unlock("fred")
+        skype_item = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        first = skype_item.decrypt()
+        with mock.patch.object(c, '_decrypt_data_raw') as decrypt_data:
+            self.assertEqual(skype_item.decrypt(), first)
+            self.assertEqual(decrypt_data.call_count, 0)
+        self.assertEqual((item_cache.hits, item_cache.misses), (1, 1))
+        # another keychain sharing the cache keeps its entries
+        item_cache.put(('/elsewhere.cloudkeychain', skype_item.uuid, skype_item.updated), b'{}')
+        c.lock()
+        self.assertEqual(len(item_cache), 1)
+        self.assertEqual(c.items, [])
+        self.assertEqual(c.master_key, None)
+
+    def test_item_key_cache(self):
+        c = onepassword.keychain.CKeychain(self.test_file_root)
+        c.unlock("fred")
+        skype_item = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        expected = skype_item.decrypt()
+        with mock.patch.object(c._master_decryptor, 'decrypt_key') as decrypt_key:
+            self.assertEqual(skype_item.decrypt(), expected)
+            self.assertEqual(decrypt_key.call_count, 0)
+        self.assertEqual(len(c.item_key_cache), 1)
+        c.lock()
+        self.assertEqual(len(c.item_key_cache), 0)
+
+    def test_item_key_cache_disabled(self):
+        c = onepassword.keychain.CKeychain(self.test_file_root, item_key_cache_size=0)
+        c.unlock("fred")
+        skype_item = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        decrypt_key = c._master_decryptor.decrypt_key
+        with mock.patch.object(c._master_decryptor, 'decrypt_key', wraps=decrypt_key) as decrypt_key:
+            self.assertEqual(skype_item.decrypt()['fields'][1]['value'], 'dej3ur9unsh5ian1and5')
+            self.assertEqual(skype_item.decrypt()['fields'][1]['value'], 'dej3ur9unsh5ian1and5')
+            self.assertEqual(decrypt_key.call_count, 2)
+
+    def test_decrypt_many(self):
+        c = onepassword.keychain.CKeychain(self.test_file_root)
+        c.unlock("fred")
+        expected = [(item, item.decrypt()) for item in c.items]
+        self.assertEqual(list(c.decrypt_all(max_workers=4, window=3)), expected)
+        self.assertEqual(list(c.decrypt_all(max_workers=1)), expected)
+        with mock.patch.dict(sys.modules, {'concurrent.futures': None}):
+            self.assertEqual(list(c.decrypt_all(max_workers=4)), expected)
+        uuids = ['2A632FDD32F5445E91EB5636C7580447', c.items[0].uuid]
+        self.assertEqual(
+            [(item.uuid, data) for item, data in c.decrypt_many(uuids)],
+            [(uuid, c.get_by_uuid(uuid).decrypt()) for uuid in uuids],
+        )
+
+
+class CloudKeychainRefreshTestCase(TestCase):
+    def setUp(self):
+        self.root = copy_vault(self, CloudKeychainIntegrationTestCase.test_file_root)
+        self.keychain = onepassword.keychain.CKeychain(self.root)
+        self.keychain.unlock("fred")
+
+    def band_path(self, band):
+        return os.path.join(self.root, 'default', 'band_%s.js' % band)
+
+    def read_band(self, band):
+        with open(self.band_path(band)) as f:
+            return simplejson.loads(f.read()[3:-2])
+
+    def write_band(self, band, data):
+        with open(self.band_path(band), 'w') as f:
+            f.write('ld(%s);' % simplejson.dumps(data, indent=2))
+        # make sure the change is visible even on coarse-mtime filesystems
+        st = os.stat(self.band_path(band))
+        os.utime(self.band_path(band), (st.st_atime, st.st_mtime + 10))
+
+    def test_overall_hmac_matches_band(self):
+        for blob in self.read_band('0').values():
+            self.assertEqual(crypt_util.opdata1_overall_hmac(self.keychain.overview_hmac, blob), blob['hmac'])
+
+    def test_noop(self):
+        items = self.keychain.items
+        self.assertEqual(self.keychain.refresh(), ([], [], []))
+        self.assertIs(self.keychain.items, items)
+
+    def test_changes(self):
+        c = self.keychain
+        untouched = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        band_0 = self.read_band('0')
+        (personal_uuid, personal), = [(u, b) for u, b in band_0.items() if u.startswith('0EDE')]
+        personal['updated'] += 1
+        personal['hmac'] = crypt_util.opdata1_overall_hmac(c.overview_hmac, personal)
+        self.write_band('0', band_0)
+        removed_uuids = sorted(self.read_band('1'))
+        os.unlink(self.band_path('1'))
+
+        added, updated, removed = c.refresh()
+        self.assertEqual((added, updated, sorted(removed)), ([], [personal_uuid], removed_uuids))
+        self.assertEqual(c.get_by_uuid(personal_uuid).updated, personal['updated'])
+        self.assertIs(c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447'), untouched)
+        for uuid in removed_uuids:
+            self.assertNotIn(uuid, c.items_by_uuid)
+
+        fresh = onepassword.keychain.CKeychain(self.root)
+        fresh.unlock("fred")
+        self.assertEqual(sorted(i.uuid for i in c.items), sorted(i.uuid for i in fresh.items))
+        self.assertEqual(
+            dict((k, sorted(i.uuid for i in v)) for k, v in c.items_by_category.items()),
+            dict((k, sorted(i.uuid for i in v)) for k, v in fresh.items_by_category.items()),
+        )
+
+    def test_columnar_changes(self):
+        c = onepassword.keychain.CKeychain(self.root, columnar=True)
+        c.unlock("fred")
+        self.assertEqual(c.refresh(), ([], [], []))
+        band_0 = self.read_band('0')
+        (personal_uuid, personal), = [(u, b) for u, b in band_0.items() if u.startswith('0EDE')]
+        personal['updated'] += 1
+        personal['hmac'] = crypt_util.opdata1_overall_hmac(c.overview_hmac, personal)
+        self.write_band('0', band_0)
+        removed_uuids = sorted(self.read_band('1'))
+        os.unlink(self.band_path('1'))
+        self.assertEqual(c.refresh(), ([], [personal_uuid], removed_uuids))
+        self.assertEqual(c.get_by_uuid(personal_uuid).updated, personal['updated'])
+        with self.assertRaises(KeyError):
+            c.get_by_uuid(removed_uuids[0])
+
+    def test_frozen_changes(self):
+        c = self.keychain
+        c.freeze()
+        self.assertEqual(c.refresh(), ([], [], []))
+        removed_uuids = sorted(self.read_band('1'))
+        os.unlink(self.band_path('1'))
+        self.assertEqual(c.refresh(), ([], [], removed_uuids))
+        self.assertIsInstance(c.store, Snapshot)
+        self.assertEqual(c.items, [])
+        with self.assertRaises(KeyError):
+            c.get_by_uuid(removed_uuids[0])
+
+    def test_search_index_follows_changes(self):
+        c = self.keychain
+        removed_uuids = set(self.read_band('1'))
+        for uuid in removed_uuids:
+            self.assertIn(uuid, c.search_index)
+        os.unlink(self.band_path('1'))
+        c.refresh()
+        self.assertEqual(len(c.search_index), len(c.items))
+        for uuid in removed_uuids:
+            self.assertNotIn(uuid, c.search_index)
+
+    def test_added(self):
+        band_0 = self.read_band('0')
+        uuid = sorted(band_0)[0]
+        blob = band_0.pop(uuid)
+        self.write_band('0', band_0)
+        self.assertEqual(self.keychain.refresh(), ([], [], [uuid]))
+        band_0[uuid] = blob
+        self.write_band('0', band_0)
+        self.assertEqual(self.keychain.refresh(), ([uuid], [], []))
+        self.assertEqual(self.keychain.get_by_uuid(uuid).uuid, uuid)
+
+
+class CloudKeychainOverviewIndexTestCase(TestCase):
+    def setUp(self):
+        self.root = copy_vault(self, CloudKeychainIntegrationTestCase.test_file_root)
+        self.index_path = os.path.join(temp_dir(self), 'index')
+
+    def unlocked(self):
+        c = onepassword.keychain.CKeychain(self.root, index_path=self.index_path)
+        c.unlock("fred")
+        return c
+
+    def test_index_used_on_cold_start(self):
+        full = self.unlocked()
+        self.assertTrue(os.path.exists(self.index_path))
+        with mock.patch.object(onepassword.keychain, '_iter_band') as iter_band:
+            c = self.unlocked()
+            self.assertEqual(iter_band.call_count, 0)
+        self.assertEqual([i.uuid for i in c.items], [i.uuid for i in full.items])
+        self.assertEqual([i.title for i in c.items], [i.title for i in full.items])
+        self.assertEqual(sorted(c.items_by_category), sorted(full.items_by_category))
+        skype_item = c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        self.assertEqual(skype_item.encrypted_overview, None)
+        self.assertEqual(skype_item.decrypt()['fields'][1]['value'], 'dej3ur9unsh5ian1and5')
+
+    def test_decrypt_all_reads_each_band_once(self):
+        expected = dict((item.uuid, data) for item, data in self.unlocked().decrypt_all(max_workers=1))
+        c = self.unlocked()
+        with mock.patch.object(onepassword.keychain, '_iter_band', wraps=onepassword.keychain._iter_band) as iter_band:
+            self.assertEqual(dict((item.uuid, data) for item, data in c.decrypt_all(max_workers=1)), expected)
+            self.assertEqual(iter_band.call_count, len(c._band_paths()))
+
+    def test_stale_index_falls_back(self):
+        self.unlocked()
+        band = os.path.join(self.root, 'default', 'band_1.js')
+        st = os.stat(band)
+        os.utime(band, (st.st_atime, st.st_mtime + 10))
+        with mock.patch.object(onepassword.keychain, '_iter_band', wraps=onepassword.keychain._iter_band) as iter_band:
+            c = self.unlocked()
+            self.assertTrue(iter_band.call_count > 0)
+        self.assertEqual(c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447').title, 'Skype')
+
+    def test_corrupt_index_ignored(self):
+        self.unlocked()
+        with open(self.index_path, 'rb') as f:
+            record = f.read()
+        with open(self.index_path, 'wb') as f:
+            f.write(record[:-1] + b'\x00')
+        self.assertEqual(self.unlocked().get_by_uuid('2A632FDD32F5445E91EB5636C7580447').title, 'Skype')
+
+    def test_freeze(self):
+        self.unlocked()
+        c = self.unlocked()
+        # one item with its data already read, the rest not
+        c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447').decrypt()
+        with mock.patch.object(onepassword.keychain, '_iter_band', wraps=onepassword.keychain._iter_band) as iter_band:
+            c.freeze()
+            self.assertEqual(iter_band.call_count, len(c._band_paths()))
+        self.assertIsInstance(c.store, Snapshot)
+        self.assertEqual([i.title for i in c.search('sky')], ['Skype'])
+        self.assertEqual(c.get_by_uuid('2A632FDD32F5445E91EB5636C7580447').decrypt()['fields'][1]['value'],
+                         'dej3ur9unsh5ian1and5')
+        self.assertEqual(sorted(i.title for i in c.store.items()), sorted(i.title for i in self.unlocked().items))
@@ -0,0 +1,113 @@
+import os
+import threading
+
+import mock
+import six
+from unittest2 import TestCase
+
+import onepassword.keychain
+from onepassword.server import STATUS_ERROR, STATUS_NOT_FOUND, KeychainClient, KeychainServer, KeychainServerError
+from . import agilekeychain_tests, cloudkeychain_tests
+from ..helpers import temp_dir
+
+
+class KeychainServerTestCase(TestCase):
+    def setUp(self):
+        self.socket_path = os.path.join(temp_dir(self), 'keychain.sock')
+
+    def serve(self, keychain):
+        server = KeychainServer(keychain, self.socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.addCleanup(stop)
+        client = KeychainClient(self.socket_path, pool_size=2)
+        self.addCleanup(client.close)
+        return client
+
+    def test_cloudkeychain(self):
+        keychain = onepassword.keychain.CKeychain(cloudkeychain_tests.CloudKeychainIntegrationTestCase.test_file_root)
+        keychain.unlock("fred")
+        client = self.serve(keychain)
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o777, 0o600)
+        self.assertEqual(len(client.list()), len(keychain.items))
+        skype = client.get('2A632FDD32F5445E91EB5636C7580447')
+        self.assertEqual((skype['title'], skype['category']), ('Skype', 'Login'))
+        self.assertEqual(client.decrypt(skype['uuid'])['fields'][1]['value'], 'dej3ur9unsh5ian1and5')
+        self.assertEqual([i['title'] for i in client.search('sky')], ['Skype'])
+        self.assertEqual([i['title'] for i in client.find_by_domain('https://www.hulu.com/')], ['Hulu'])
+        self.assertEqual(client.refresh(), ([], [], []))
+        with self.assertRaises(KeyError):
+            client.decrypt('nonexistent')
+
+    def test_columnar_cloudkeychain(self):
+        keychain = onepassword.keychain.CKeychain(
+            cloudkeychain_tests.CloudKeychainIntegrationTestCase.test_file_root, columnar=True)
+        keychain.unlock("fred")
+        client = self.serve(keychain)
+        self.assertEqual(len(client.list()), len(keychain.store))
+        self.assertEqual(client.get('2A632FDD32F5445E91EB5636C7580447')['title'], 'Skype')
+
+    def test_agilekeychain(self):
+        keychain = onepassword.keychain.AKeychain(agilekeychain_tests.AgileKeychainIntegrationTestCase.test_file_root)
+        keychain.unlock("george")
+        client = self.serve(keychain)
+        self.assertEqual(client.decrypt('00925AACC28B482ABFE650FCD42F82CD')['fields'][1]['value'], 'test_password')
+
+    def test_errors_and_pooling(self):
+        keychain = onepassword.keychain.CKeychain(cloudkeychain_tests.CloudKeychainIntegrationTestCase.test_file_root)
+        client = self.serve(keychain)
+        # locked: nothing to find, and decrypting needs keys we don't have
+        self.assertEqual(client.list(), [])
+        with self.assertRaises(KeychainServerError):
+            client._call(99)
+        threads = [threading.Thread(target=client.list) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(client._pool.qsize(), 2)
+
+    def test_bad_requests(self):
+        keychain = onepassword.keychain.CKeychain(cloudkeychain_tests.CloudKeychainIntegrationTestCase.test_file_root)
+        keychain.unlock("fred")
+        server = KeychainServer(keychain, self.socket_path)
+        self.addCleanup(server.server_close)
+        self.assertEqual(six.indexbytes(server.dispatch(b'\x02\xff'), 0), STATUS_ERROR)
+        self.assertEqual(six.indexbytes(server.dispatch(b'\x02nonexistent'), 0), STATUS_NOT_FOUND)
+        skype = keychain.get_by_uuid('2A632FDD32F5445E91EB5636C7580447')
+        # a KeyError while decrypting isn't "not found"
+        with mock.patch.object(keychain, '_decrypt_data_raw', side_effect=KeyError('d')):
+            response = server.dispatch(b'\x03' + skype.uuid.encode('ascii'))
+        self.assertEqual(six.indexbytes(response, 0), STATUS_ERROR)
+
+    def test_refuses_to_replace_other_files(self):
+        with open(self.socket_path, 'w') as f:
+            f.write('important')
+        with self.assertRaises(KeychainServerError):
+            KeychainServer(None, self.socket_path)
+        with open(self.socket_path) as f:
+            self.assertEqual(f.read(), 'important')
+
+    def test_fork(self):
+        if not hasattr(os, 'fork'):
+            self.skipTest('needs os.fork')
+        keychain = onepassword.keychain.CKeychain(cloudkeychain_tests.CloudKeychainIntegrationTestCase.test_file_root)
+        keychain.unlock("fred")
+        client = self.serve(keychain)
+        client.list()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = client.get('2A632FDD32F5445E91EB5636C7580447')['title'] == 'Skype'
+            except Exception:
+                ok = False
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.assertEqual(client.get('2A632FDD32F5445E91EB5636C7580447')['title'], 'Skype')
@@ -0,0 +1,73 @@
+import os.path
+import threading
+
+import simplejson
+from unittest2 import TestCase
+
+import onepassword.keychain
+from onepassword import watcher
+from . import cloudkeychain_tests
+from ..helpers import copy_vault
+
+
+class KeychainWatcherTestCase(TestCase):
+    use_inotify = False
+
+    def setUp(self):
+        if self.use_inotify and watcher._libc is None:
+            self.skipTest('inotify not available')
+        self.root = copy_vault(self, cloudkeychain_tests.CloudKeychainIntegrationTestCase.test_file_root)
+        self.keychain = onepassword.keychain.CKeychain(self.root)
+        self.keychain.unlock("fred")
+        self.changed = threading.Event()
+        self.changes = []
+        self.relocked = threading.Event()
+        self.watcher = watcher.KeychainWatcher(
+            self.keychain,
+            on_change=lambda *changes: (self.changes.append(changes), self.changed.set()),
+            on_unlock_required=lambda keychain: self.relocked.set(),
+            debounce=0.05,
+            poll_interval=0.05,
+            use_inotify=self.use_inotify,
+        )
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.stop()
+
+    def path(self, name):
+        return os.path.join(self.root, 'default', name)
+
+    def test_band_removed(self):
+        with open(self.path('band_1.js')) as f:
+            removed = sorted(simplejson.loads(f.read()[3:-2]))
+        os.unlink(self.path('band_1.js'))
+        self.assertTrue(self.changed.wait(5))
+        self.assertEqual(self.changes, [([], [], removed)])
+        for uuid in removed:
+            self.assertNotIn(uuid, self.keychain.items_by_uuid)
+
+    def test_burst_is_debounced(self):
+        for band in ('1', '3', '5'):
+            os.unlink(self.path('band_%s.js' % band))
+        self.assertTrue(self.changed.wait(5))
+        self.watcher.stop()
+        self.assertEqual(len(self.changes), 1)
+        self.assertEqual(len(self.changes[0][2]), 3)
+
+    def test_profile_change_locks(self):
+        with open(self.path('profile.js')) as f:
+            profile = f.read()
+        with open(self.path('profile.js'), 'w') as f:
+            f.write(profile.replace('"lastUpdatedBy":"Dropbox"', '"lastUpdatedBy":"Test"'))
+        self.assertTrue(self.relocked.wait(5))
+        self.assertTrue(self.watcher.unlock_required)
+        self.assertEqual(self.keychain.items, [])
+        self.assertEqual(self.keychain.master_key, None)
+        self.watcher.unlock("fred")
+        self.assertFalse(self.watcher.unlock_required)
+        self.assertEqual(self.keychain.get_by_uuid('2A632FDD32F5445E91EB5636C7580447').title, 'Skype')
+
+
+class InotifyKeychainWatcherTestCase(KeychainWatcherTestCase):
+    use_inotify = True
@@ -0,0 +1,101 @@
+from unittest2 import TestCase
+
+from onepassword import cache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTestCase(TestCase):
+    def test_get_put(self):
+        c = cache.LRUCache()
+        self.assertEqual(c.get('a'), None)
+        c.put('a', b'1')
+        self.assertEqual(c.get('a'), b'1')
+        self.assertEqual((c.hits, c.misses), (1, 1))
+
+    def test_max_entries_evicts_least_recently_used(self):
+        c = cache.LRUCache(max_entries=2)
+        c.put('a', b'1')
+        c.put('b', b'2')
+        c.get('a')
+        c.put('c', b'3')
+        self.assertIn('a', c)
+        self.assertNotIn('b', c)
+        self.assertIn('c', c)
+        self.assertEqual(c.evictions, 1)
+
+    def test_max_bytes(self):
+        c = cache.LRUCache(max_bytes=4)
+        c.put('a', b'12')
+        c.put('b', b'34')
+        self.assertEqual(c.size, 4)
+        c.put('c', b'5')
+        self.assertNotIn('a', c)
+        self.assertEqual(c.size, 3)
+        c.put('d', b'123456')
+        self.assertNotIn('d', c)
+        self.assertEqual(c.size, 3)
+
+    def test_ttl(self):
+        clock = FakeClock()
+        c = cache.LRUCache(ttl=10, clock=clock)
+        c.put('a', b'1')
+        clock.now = 10
+        self.assertEqual(c.get('a'), b'1')
+        clock.now = 11
+        self.assertEqual(c.get('a'), None)
+        self.assertEqual(len(c), 0)
+
+    def test_on_evict(self):
+        evicted = []
+        c = cache.LRUCache(max_entries=1, on_evict=evicted.append)
+        c.put('a', b'1')
+        c.put('b', b'2')
+        c.invalidate('b')
+        self.assertEqual(evicted, [b'1', b'2'])
+
+    def test_copy_runs_under_the_lock(self):
+        c = cache.LRUCache(copy=lambda value: (c._lock.locked(), bytes(value)))
+        c.put('a', bytearray(b'1'))
+        # so an eviction on another thread can't zeroize the value mid-copy
+        self.assertEqual(c.get('a'), (True, b'1'))
+
+
+class KeyCacheTestCase(TestCase):
+    def test_keyed_on_password_and_params(self):
+        c = cache.KeyCache()
+        c.put('/vault', 'password', ('salt', 1000), (b'key', b'hmac'))
+        self.assertEqual(c.get('/vault', 'password', ('salt', 1000)), (b'key', b'hmac'))
+        self.assertEqual(c.get('/vault', 'wrong', ('salt', 1000)), None)
+        self.assertEqual(c.get('/vault', 'password', ('salt', 2000)), None)
+        self.assertEqual(c.get('/other', 'password', ('salt', 1000)), None)
+
+    def test_invalidate_zeroizes(self):
+        c = cache.KeyCache()
+        c.put('/vault', 'password', (), (b'key',))
+        c.put('/other', 'password', (), (b'key',))
+        stored = c._cache._entries[c._key('/vault', 'password', ())][0]
+        c.invalidate('/vault')
+        self.assertEqual(stored, (bytearray(b'\x00\x00\x00'),))
+        self.assertEqual(c.get('/vault', 'password', ()), None)
+        self.assertEqual(c.get('/other', 'password', ()), (b'key',))
+        c.clear()
+        self.assertEqual(len(c), 0)
+
+
+class ItemCacheTestCase(TestCase):
+    def test_returns_bytes_and_zeroizes(self):
+        c = cache.ItemCache(max_bytes=8)
+        c.put('a', b'secret')
+        self.assertEqual(c.get('a'), b'secret')
+        stored = c._entries['a'][0]
+        c.put('b', b'other')
+        self.assertEqual(stored, bytearray(6))
+        self.assertEqual(c.get('a'), None)
+        self.assertEqual(c.stats()['evictions'], 1)
@@ -1,13 +1,19 @@
 import base64
 import hashlib
 import hmac
+import io
+import mmap
+import os
 import struct
 from unittest2 import TestCase
 
 import simplejson
+import six
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
-from onepassword import crypt_util
-from ..helpers import assert_raises
+from onepassword import crypt_util, padding, pbkdf1
+from ..helpers import assert_raises, temp_dir
 
 
 class HexizeTestCase(TestCase):
@@ -42,9 +48,8 @@ class OPData1KeyDerivationTestCase(TestCase):
 
 
 class OPData1UnpackTestCase(TestCase):
-    def build_opdata1(self):
+    def build_opdata1(self, plaintext=b""):
         header = b"opdata01"
-        plaintext = b""
         plaintext_len = struct.pack(b"<Q", len(plaintext))
         iv = b"".join(chr(x).encode('utf-8') for x in range(16))
         cryptext = plaintext
@@ -72,6 +77,13 @@ class OPData1UnpackTestCase(TestCase):
         self.assertEqual(plaintext_length, 0)
         self.assertEqual(cryptext, b"")
 
+    def test_unpack_does_not_copy(self):
+        packed = bytearray(self.build_opdata1(b"x" * 16))
+        _, _, cryptext, _, hmac_d_data = crypt_util.opdata1_unpack(packed)
+        packed[32] = ord(b"y")
+        self.assertEqual(cryptext.tobytes(), b"y" + b"x" * 15)
+        self.assertEqual(hmac_d_data.tobytes(), bytes(packed[:-32]))
+
 
 class OPdata1DecryptTestCase(TestCase):
     """test specific data from the example keychain provided by AgileBits"""
@@ -119,3 +131,130 @@ class OPdata1DecryptTestCase(TestCase):
         decrypted = crypt_util.opdata1_decrypt_item(source_data, self.OVERVIEW_KEY, self.OVERVIEW_HMAC, ignore_hmac=True)
         data = simplejson.loads(decrypted)
         self.assertEqual(data, expected_data)
+
+    def test_encrypt_roundtrip(self):
+        for plaintext in (b'', b'a', b'x' * 16, b'{"title": "Personal"}' * 10):
+            record = crypt_util.opdata1_encrypt_item(plaintext, self.OVERVIEW_KEY, self.OVERVIEW_HMAC)
+            self.assertEqual(record[:8], b'opdata01')
+            self.assertEqual(crypt_util.opdata1_decrypt_item(record, self.OVERVIEW_KEY, self.OVERVIEW_HMAC), plaintext)
+
+    def test_decrypt_from_buffers(self):
+        plaintext = b'{"title": "Personal"}' * 10
+        record = crypt_util.opdata1_encrypt_item(plaintext, self.OVERVIEW_KEY, self.OVERVIEW_HMAC)
+        for data in (bytearray(record), memoryview(record)):
+            self.assertEqual(crypt_util.opdata1_decrypt_item(data, self.OVERVIEW_KEY, self.OVERVIEW_HMAC), plaintext)
+
+    def test_decrypt_file(self):
+        plaintext = os.urandom(100000)
+        path = os.path.join(temp_dir(self), 'attachment')
+        with open(path, 'wb') as f:
+            f.write(crypt_util.opdata1_encrypt_item(plaintext, self.OVERVIEW_KEY, self.OVERVIEW_HMAC))
+        self.assertEqual(crypt_util.opdata1_decrypt_file(path, self.OVERVIEW_KEY, self.OVERVIEW_HMAC), plaintext)
+        with assert_raises(ValueError):
+            crypt_util.opdata1_decrypt_file(path, self.OVERVIEW_KEY, self.MASTER_HMAC)
+
+    def test_decrypt_stream(self):
+        for length in (0, 1, 15, 16, 17, 100000):
+            plaintext = os.urandom(length)
+            record = crypt_util.opdata1_encrypt_item(plaintext, self.OVERVIEW_KEY, self.OVERVIEW_HMAC)
+            for chunk_size in (16, 1000, 64 * 1024):
+                sink = io.BytesIO()
+                written = crypt_util.opdata1_decrypt_stream(
+                    io.BytesIO(record), sink, self.OVERVIEW_KEY, self.OVERVIEW_HMAC, chunk_size=chunk_size)
+                self.assertEqual(written, length)
+                self.assertEqual(sink.getvalue(), plaintext)
+
+    def test_decrypt_stream_from_mmap(self):
+        plaintext = os.urandom(100000)
+        path = os.path.join(temp_dir(self), 'attachment')
+        with open(path, 'wb') as f:
+            f.write(crypt_util.opdata1_encrypt_item(plaintext, self.OVERVIEW_KEY, self.OVERVIEW_HMAC))
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        sink = io.BytesIO()
+        crypt_util.opdata1_decrypt_stream(mapped, sink, self.OVERVIEW_KEY, self.OVERVIEW_HMAC, chunk_size=4096)
+        mapped.close()
+        self.assertEqual(sink.getvalue(), plaintext)
+
+    def test_decrypt_stream_checks_hmac_first(self):
+        record = bytearray(crypt_util.opdata1_encrypt_item(b'x' * 1000, self.OVERVIEW_KEY, self.OVERVIEW_HMAC))
+        record[-40] ^= 1
+        sink = io.BytesIO()
+        with assert_raises(ValueError):
+            crypt_util.opdata1_decrypt_stream(io.BytesIO(bytes(record)), sink, self.OVERVIEW_KEY, self.OVERVIEW_HMAC)
+        self.assertEqual(sink.getvalue(), b'')
+        with assert_raises(TypeError):
+            crypt_util.opdata1_decrypt_stream(io.BytesIO(b'opdata02' + bytes(record[8:])), sink,
+                                              self.OVERVIEW_KEY, self.OVERVIEW_HMAC)
+
+
+class DecryptorTestCase(TestCase):
+    def test_c_decryptor_reuse(self):
+        key, hmac_key = os.urandom(32), os.urandom(32)
+        decryptor = crypt_util.CDecryptor(key, hmac_key)
+        # several sizes, twice over
+        for length in (0, 1, 100, 1000, 1024, 1500, 5000) * 2:
+            plaintext = os.urandom(length)
+            record = crypt_util.opdata1_encrypt_item(plaintext, key, hmac_key)
+            self.assertEqual(decryptor.decrypt_item(record), plaintext)
+        with assert_raises(ValueError):
+            decryptor.decrypt_item(crypt_util.opdata1_encrypt_item(b'x', key, os.urandom(32)))
+        self.assertEqual(decryptor.decrypt_item(crypt_util.opdata1_encrypt_item(b'y', key, hmac_key)), b'y')
+
+    def test_c_decryptor_key(self):
+        source_data = base64.b64decode("R+JJyjeDfDC49x0XwaW5eJkJhG9COpfzFPSo8P2ZDa6ZYeLRzyjeukgdtDj5Yg7F0l2fMCbHKmOtQUXRQxCfsaCcsTeDR10WGMlzQtJoygmdMreG9joX18JPFWtDo/P94sbn8Wd0Q+Sx18Whdo0lRA==")
+        decryptor = crypt_util.CDecryptor(OPdata1DecryptTestCase.MASTER_KEY, OPdata1DecryptTestCase.MASTER_HMAC)
+        expected = crypt_util.opdata1_decrypt_key(
+            source_data, OPdata1DecryptTestCase.MASTER_KEY, OPdata1DecryptTestCase.MASTER_HMAC)
+        self.assertEqual(decryptor.decrypt_key(source_data), expected)
+        self.assertEqual(decryptor.decrypt_key(source_data), expected)
+        with assert_raises(ValueError):
+            decryptor.decrypt_key(source_data[:-1] + six.int2byte(six.indexbytes(source_data, -1) ^ 1))
+
+    def test_a_decryptor_matches_pbkdf1(self):
+        key = os.urandom(16)
+        decryptor = crypt_util.ADecryptor(key)
+        for _ in range(10):
+            salt = os.urandom(crypt_util.SALT_SIZE)
+            pb_gen = pbkdf1.PBKDF1(key, salt)
+            nkey, iv = pb_gen.read(16), pb_gen.read(16)
+            encryptor = Cipher(algorithms.AES(nkey), modes.CBC(iv), backend=default_backend()).encryptor()
+            plaintext = os.urandom(50)
+            data = crypt_util.SALT_MARKER + salt + encryptor.update(padding.pkcs5_pad(plaintext)) + encryptor.finalize()
+            self.assertEqual(decryptor.decrypt_item(data), plaintext)
+
+
+class OverallHMACTestCase(TestCase):
+    def make_items(self, hmac_key, n=20):
+        items = []
+        for i in range(n):
+            item = {
+                'uuid': 'F%031d' % i,
+                'category': '001',
+                'updated': 1400000000 + i,
+                'trashed': bool(i % 2),
+                'fave': i,
+                'o': u'b3BkYXRh\u00e9',
+                'k': base64.b64encode(os.urandom(112)).decode('ascii'),
+            }
+            item['hmac'] = crypt_util.opdata1_overall_hmac(hmac_key, item)
+            items.append(item)
+        return items
+
+    def test_verify(self):
+        hmac_key = os.urandom(32)
+        for item in self.make_items(hmac_key):
+            crypt_util.opdata1_verify_overall_hmac(hmac_key, item)
+            item['fave'] += 1
+            with assert_raises(ValueError):
+                crypt_util.opdata1_verify_overall_hmac(hmac_key, item)
+
+    def test_verify_many(self):
+        hmac_key = os.urandom(32)
+        items = self.make_items(hmac_key)
+        for max_workers in (1, 4):
+            crypt_util.opdata1_verify_overall_hmacs(hmac_key, items, max_workers=max_workers)
+        items[7]['trashed'] = not items[7]['trashed']
+        for max_workers in (1, 4):
+            with assert_raises(ValueError):
+                crypt_util.opdata1_verify_overall_hmacs(hmac_key, items, max_workers=max_workers)
@@ -0,0 +1,74 @@
+import os.path
+
+import mock
+import simplejson
+from unittest2 import TestCase
+
+from onepassword import keychain
+from ..helpers import temp_dir
+
+
+class IterBandTestCase(TestCase):
+    sample_band = os.path.realpath(os.path.join(
+        __file__, '..', '..', '..', 'data', 'sample.cloudkeychain', 'default', 'band_0.js'
+    ))
+
+    def setUp(self):
+        self.tmpdir = temp_dir(self)
+        patcher = mock.patch.object(keychain.crypt_util, 'OverallHMACVerifier')
+        self.verify = patcher.start().return_value.verify
+        self.addCleanup(patcher.stop)
+
+    def write_band(self, contents):
+        path = os.path.join(self.tmpdir, 'band_0.js')
+        with open(path, 'wb') as f:
+            f.write(contents)
+        return path
+
+    def test_matches_full_parse(self):
+        with open(self.sample_band, 'rb') as f:
+            expected = list(simplejson.loads(f.read()[3:-2]).values())
+        self.assertEqual(list(keychain._iter_band(self.sample_band, b'key')), expected)
+        self.assertEqual(self.verify.call_count, len(expected))
+
+    def test_escaped_strings(self):
+        path = self.write_band(b'ld({"A": {"uuid": "A", "o": "x\\"}{y"},\n"B": {"uuid": "B", "n": 1}});')
+        self.assertEqual(
+            list(keychain._iter_band(path, b'key')),
+            [{'uuid': 'A', 'o': 'x"}{y'}, {'uuid': 'B', 'n': 1}],
+        )
+
+    def test_items_parsed_once(self):
+        path = self.write_band(b'ld({"A": {"uuid": "A", "o": "' + b'}' * 100 + b'", "x": {"y": "}"}}});')
+        with mock.patch.object(keychain.simplejson, 'loads', wraps=simplejson.loads) as loads:
+            self.assertEqual(list(keychain._iter_band(path, b'key')), [{'uuid': 'A', 'o': '}' * 100, 'x': {'y': '}'}}])
+            self.assertEqual(loads.call_count, 1)
+
+    def test_nested_objects(self):
+        path = self.write_band(b'ld({"A": {"uuid": "A"}, "B": {"uuid": "B", "x": {"y": {}}}, "C": {"uuid": "C"}});')
+        self.assertEqual(
+            [blob['uuid'] for blob in keychain._iter_band(path, b'key')],
+            ['A', 'B', 'C'],
+        )
+        self.assertEqual(self.verify.call_count, 3)
+
+    def test_malformed(self):
+        path = self.write_band(b'ld({"A": {"uuid": "A"}, "B": {"uuid": "B"});')
+        with self.assertRaises(ValueError):
+            list(keychain._iter_band(path, b'key'))
+        path = self.write_band(b'ld({"A": {"uuid": "A"}, garbage});')
+        with self.assertRaises(ValueError):
+            list(keychain._iter_band(path, b'key'))
+
+    def test_band_rewritten_while_iterating(self):
+        path = self.write_band(b'ld({"A": {"uuid": "A"}, "B": {"uuid": "B"}});')
+        blobs = keychain._iter_band(path, b'key')
+        self.assertEqual(next(blobs), {'uuid': 'A'})
+        # a sync client truncating the file mid-read
+        with open(path, 'wb'):
+            pass
+        self.assertEqual(list(blobs), [{'uuid': 'B'}])
+
+    def test_empty(self):
+        self.assertEqual(list(keychain._iter_band(self.write_band(b''), b'key')), [])
+        self.assertEqual(list(keychain._iter_band(self.write_band(b'ld({});'), b'key')), [])
@@ -37,6 +37,29 @@ class PBKDF2SHA1TestCase(TestCase):
             generated = _pbkdf2_nettle.pbkdf2_sha1(password, salt, length=16, iterations=iterations)
             self.assertEqual(generated, expected_key)
 
+    @ignore_import_error
+    def test_batch_cryptography(self):
+        from onepassword import _pbkdf2_cryptography
+        jobs = [(password, salt, iterations) for password, salt, iterations, _ in self.VECTORS]
+        generated = _pbkdf2_cryptography.pbkdf2_sha1_batch(jobs, length=16, max_workers=3)
+        self.assertEqual(generated, [expected_key for _, _, _, expected_key in self.VECTORS])
+
+    @ignore_import_error
+    def test_batch_nettle(self):
+        from onepassword import _pbkdf2_nettle
+        jobs = [(password, salt, iterations) for password, salt, iterations, _ in self.VECTORS]
+        generated = _pbkdf2_nettle.pbkdf2_sha1_batch(jobs, length=16, max_workers=3)
+        self.assertEqual(generated, [expected_key for _, _, _, expected_key in self.VECTORS])
+
+    def test_batch_default_backend(self):
+        from onepassword import pbkdf2
+        jobs = [(password, salt, iterations) for password, salt, iterations, _ in self.VECTORS]
+        self.assertEqual(
+            pbkdf2.pbkdf2_sha1_batch(jobs, length=16),
+            [expected_key for _, _, _, expected_key in self.VECTORS],
+        )
+        self.assertEqual(pbkdf2.pbkdf2_sha1_batch([], length=16), [])
+
 
 class PBKDF2SHA512TestCase(TestCase):
     VECTORS = (
@@ -61,3 +84,44 @@ class PBKDF2SHA512TestCase(TestCase):
             generated = _pbkdf2_nettle.pbkdf2_sha512(password, salt, length=16, iterations=iterations)
             self.assertEqual(generated, expected_key)
 
+    @ignore_import_error
+    def test_batch_cryptography(self):
+        from onepassword import _pbkdf2_cryptography
+        jobs = [(password, salt, iterations) for password, salt, iterations, _ in self.VECTORS]
+        generated = _pbkdf2_cryptography.pbkdf2_sha512_batch(jobs, length=16, max_workers=3)
+        self.assertEqual(generated, [expected_key for _, _, _, expected_key in self.VECTORS])
+
+    @ignore_import_error
+    def test_batch_nettle(self):
+        from onepassword import _pbkdf2_nettle
+        jobs = [(password, salt, iterations) for password, salt, iterations, _ in self.VECTORS]
+        generated = _pbkdf2_nettle.pbkdf2_sha512_batch(jobs, length=16, max_workers=3)
+        self.assertEqual(generated, [expected_key for _, _, _, expected_key in self.VECTORS])
+
+    def test_batch_default_backend(self):
+        from onepassword import pbkdf2
+        jobs = [(password, salt, iterations) for password, salt, iterations, _ in self.VECTORS]
+        self.assertEqual(
+            pbkdf2.pbkdf2_sha512_batch(jobs, length=16),
+            [expected_key for _, _, _, expected_key in self.VECTORS],
+        )
+        self.assertEqual(pbkdf2.pbkdf2_sha512_batch([], length=16), [])
+
+
+class NettleContextTestCase(TestCase):
+    @ignore_import_error
+    def test_context_sizes(self):
+        import ctypes
+        from onepassword import _pbkdf2_nettle
+        # sizeof(struct hmac_sha1_ctx) / sizeof(struct hmac_sha512_ctx) on LP64 with nettle 3.x
+        self.assertEqual(ctypes.sizeof(_pbkdf2_nettle._HmacSha1Ctx), 312)
+        self.assertEqual(ctypes.sizeof(_pbkdf2_nettle._HmacSha512Ctx), 648)
+
+    @ignore_import_error
+    def test_context_reused_and_wiped(self):
+        from onepassword import _pbkdf2_nettle
+        _pbkdf2_nettle.pbkdf2_sha1(b'password', b'salt', 16, 1)
+        ctx = _pbkdf2_nettle._context(_pbkdf2_nettle._SHA1)
+        _pbkdf2_nettle.pbkdf2_sha1(b'password', b'salt', 16, 1)
+        self.assertIs(_pbkdf2_nettle._context(_pbkdf2_nettle._SHA1), ctx)
+        self.assertEqual(bytes(bytearray(ctx.outer.block)), b'\x00' * 64)
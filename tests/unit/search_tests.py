@@ -0,0 +1,49 @@
+import collections
+
+from unittest2 import TestCase
+
+from onepassword.search import SearchIndex, host_of, tokenize
+
+Item = collections.namedtuple('Item', ('uuid', 'title', 'urls', 'tags'))
+
+
+class SearchIndexTestCase(TestCase):
+    def setUp(self):
+        self.index = SearchIndex([
+            Item('A', 'Bank of America', ['https://www.bankofamerica.com/'], ['finance']),
+            Item('B', 'Skype', ['https://secure.skype.com/account/login?x=1'], []),
+            Item('C', "Company's FTP", ['ftp://ftp.dreamhost.com'], ['work', 'Finance']),
+            Item('D', 'Some note', [], []),
+        ])
+
+    def test_helpers(self):
+        self.assertEqual(tokenize(u"Company's FTP Été"), [u'company', u's', u'ftp', u'été'])
+        self.assertEqual(host_of('https://www.Example.com:8080/login'), 'example.com')
+        self.assertEqual(host_of('example.com'), 'example.com')
+        self.assertEqual(host_of(''), '')
+
+    def test_search(self):
+        self.assertEqual(self.index.search('bank'), set(['A']))
+        self.assertEqual(self.index.search('ba am'), set(['A']))
+        self.assertEqual(self.index.search('finance'), set(['A', 'C']))
+        self.assertEqual(self.index.search('skype.com'), set(['B']))
+        self.assertEqual(self.index.search('so', prefix=False), set())
+        self.assertEqual(self.index.search('some', prefix=False), set(['D']))
+        self.assertEqual(self.index.search('bank skype'), set())
+        self.assertEqual(self.index.search(''), set())
+
+    def test_find_by_domain(self):
+        self.assertEqual(self.index.find_by_domain('https://bankofamerica.com/login'), set(['A']))
+        self.assertEqual(self.index.find_by_domain('a.secure.skype.com'), set(['B']))
+        self.assertEqual(self.index.find_by_domain('skype.com'), set())
+        self.assertEqual(self.index.find_by_domain('com'), set())
+
+    def test_incremental(self):
+        self.index.add(Item('B', 'Skype for Business', [], []))
+        self.assertEqual(self.index.search('business'), set(['B']))
+        self.assertEqual(self.index.find_by_domain('secure.skype.com'), set())
+        self.index.remove('A')
+        self.assertEqual(self.index.search('finance'), set(['C']))
+        self.assertEqual(self.index.search('bank'), set())
+        self.assertNotIn('bank', self.index._words)
+        self.assertEqual(len(self.index), 3)
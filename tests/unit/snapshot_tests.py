@@ -0,0 +1,55 @@
+from unittest2 import TestCase
+
+from onepassword.snapshot import Snapshot
+from onepassword.store import ItemStore
+from ..helpers import sample_blobs
+
+
+class SnapshotTestCase(TestCase):
+    def setUp(self):
+        # out of uuid order, to check that the snapshot sorts its rows
+        blobs = sample_blobs()
+        blobs = [blobs[i] for i in (3, 0, 4, 1, 2, 5)]
+        self.snapshot = Snapshot.from_store(ItemStore.from_blobs(None, blobs))
+
+    def test_columns(self):
+        self.assertEqual(len(self.snapshot), 6)
+        self.assertEqual([self.snapshot.uuid(row) for row in range(6)], ['%032X' % i for i in range(6)])
+        self.assertEqual(self.snapshot.category_code(5), '099')
+        self.assertEqual(self.snapshot.updated(0), 300)
+        self.assertEqual(self.snapshot.row('%032X' % 4), 4)
+        for uuid in ('%032X' % 6, 'nonexistent', u'é'):
+            with self.assertRaises(KeyError):
+                self.snapshot.row(uuid)
+
+    def test_rows(self):
+        self.assertEqual(list(self.snapshot.rows(category_code='001')), [0, 2, 4])
+        self.assertEqual(list(self.snapshot.rows(order_by='updated')), [5, 1, 4, 2, 0, 3])
+        self.assertEqual(list(self.snapshot.rows(since=100, until=300)), [1, 2, 4])
+        self.assertEqual(list(self.snapshot.rows(order_by='uuid', reverse=True)), [5, 4, 3, 2, 1, 0])
+        self.assertEqual(self.snapshot.count(category_code='001', since=150), 2)
+
+    def test_items(self):
+        item = self.snapshot.get_by_uuid('%032X' % 2)
+        self.assertIs(self.snapshot.item(2), item)
+        self.assertEqual((item.category, item.updated), ('Login', 200))
+        self.assertEqual(item.encrypted_overview, b'overview 2')
+        self.assertEqual(item.encrypted_data, (b'key 2', b'data 2'))
+        self.assertEqual(self.snapshot.item(5).encrypted_overview, None)
+
+    def test_freeze_items(self):
+        items = list(Snapshot.from_store(self.snapshot).items())
+        snapshot = Snapshot.freeze(None, items[:5])
+        self.assertEqual([i.uuid for i in snapshot.items()], [i.uuid for i in items[:5]])
+        self.assertEqual(snapshot.item(3).encrypted_data, (b'key 3', b'data 3'))
+
+    def test_empty(self):
+        snapshot = Snapshot.freeze(None, [])
+        self.assertEqual(len(snapshot), 0)
+        self.assertEqual(list(snapshot.rows(order_by='updated')), [])
+        with self.assertRaises(KeyError):
+            snapshot.row('%032X' % 0)
+
+    def test_not_a_snapshot(self):
+        with self.assertRaises(ValueError):
+            Snapshot(None, b'\0' * 16)
@@ -0,0 +1,45 @@
+from unittest2 import TestCase
+
+from onepassword.store import ItemStore
+from ..helpers import sample_blobs
+
+
+class ItemStoreTestCase(TestCase):
+    def setUp(self):
+        self.blobs = sample_blobs()
+        self.store = ItemStore.from_blobs(None, self.blobs)
+
+    def test_columns(self):
+        self.assertEqual(len(self.store), 6)
+        self.assertEqual(self.store.uuid(3), '%032X' % 3)
+        self.assertEqual(self.store.category_code(5), '099')
+        self.assertEqual(self.store.updated(0), 300)
+        self.assertEqual(self.store.row('%032X' % 4), 4)
+        with self.assertRaises(KeyError):
+            self.store.row('nonexistent')
+
+    def test_rows(self):
+        self.assertEqual(list(self.store.rows()), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(list(self.store.rows(category_code='001')), [0, 2, 4])
+        self.assertEqual(list(self.store.rows(category_code='004')), [])
+        self.assertEqual(list(self.store.rows(order_by='updated')), [5, 1, 4, 2, 0, 3])
+        self.assertEqual(list(self.store.rows(order_by='updated', reverse=True)), [3, 0, 2, 4, 1, 5])
+        self.assertEqual(list(self.store.rows(since=100, until=300)), [1, 2, 4])
+        self.assertEqual(list(self.store.rows(category_code='001', since=150)), [0, 2])
+        self.assertEqual(list(self.store.rows(category_code='001', since=100, order_by='updated')), [4, 2, 0])
+        self.assertEqual(list(self.store.rows(category_code='001', order_by='updated')), [4, 2, 0])
+        self.assertEqual(self.store.count(category_code='001'), 3)
+        with self.assertRaises(ValueError):
+            self.store.rows(order_by='title')
+
+    def test_items_are_created_on_demand(self):
+        self.assertEqual(self.store._materialized, {})
+        item = self.store.item(2)
+        self.assertEqual(list(self.store._materialized), [2])
+        self.assertIs(self.store.get_by_uuid('%032X' % 2), item)
+        self.assertEqual((item.uuid, item.category, item.updated), ('%032X' % 2, 'Login', 200))
+        self.assertEqual(item.encrypted_overview, b'overview 2')
+        self.assertEqual(item.encrypted_data, (b'key 2', b'data 2'))
+        tombstone = self.store.item(5)
+        self.assertEqual(tombstone.encrypted_overview, None)
+        self.assertEqual([i.uuid for i in self.store.items([4, 0])], ['%032X' % 4, '%032X' % 0])